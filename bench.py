@@ -0,0 +1,372 @@
+"""Benchmark suite for NonnoWord's hot paths.
+
+    python bench.py [--full] [--only PREFIX ...] [--out FILE] [--baseline FILE] [--save-baseline FILE] [--tolerance 0.25]
+
+Times startup (import, handing files to a running editor, first idle), load_file, write_docx,
+apply_style_to_range, get_fingerprint, perform_backup, sync_structure, keystroke latency, scrolling through
+windowed documents, edit journal replay, tracing overhead, the undo history and the .docx serializer on
+synthetic documents of several sizes, run densities and style mixes.
+The Tk cases need a display; on Linux without $DISPLAY an Xvfb server is started if one is installed,
+otherwise those cases are skipped. Results go to a JSON file as {case: seconds}. With --baseline, cases more
+than --tolerance slower than the baseline are reported as regressions and the exit status is 1, as it is
+when typing misses KEYSTROKE_BUDGET_MS, a long editing session takes the undo history past its ceiling or a
+journal replays to the wrong document.
+"""
+import argparse
+import atexit
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import zipfile
+import tkinter as tk
+from collections import deque
+from datetime import datetime, timedelta
+from script import BackupStore, DocumentModel, EditJournal, InstanceServer, Tracer, UndoHistory, WordEmulator
+
+SIZES = [(1_000, 2), (1_000, 8), (10_000, 4)]             # (paragraphs, runs per paragraph)
+FULL_SIZES = SIZES + [(50_000, 4), (100_000, 2)]
+STYLE_SWEEP = [(10_000, 10), (100_000, 10), (1_000_000, 10), (100_000, 100), (100_000, 1000), (100_000, 10_000)]
+BACKUP_FOLDER_VERSIONS = [1_000]
+FULL_BACKUP_FOLDER_VERSIONS = [1_000, 10_000]
+KEYSTROKE_BUDGET_MS = 8.0  # p95 keystroke-to-render, well inside a 60 Hz frame
+UNDO_CEILING = 4 << 20     # bytes the undo history may hold during the synthetic session
+KEYSYMS = {" ": "space", ".": "period", ",": "comma"}
+KEY_STREAMS = {
+    "prose": "The quick brown fox jumps over the lazy dog. " * 40,
+    "key_repeat": "a" * 1000,
+}
+WORDS = "lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod tempor incididunt ut labore".split()
+
+# --- Synthetic documents ---
+def synthetic_paragraphs(paragraphs, runs_per_par=4, seed=0):
+    """Deterministic paragraphs with a mix of alignments, sizes and bold/italic/underline runs."""
+    rnd = random.Random(seed)
+    out = []
+    for _ in range(paragraphs):
+        align = rnd.choices(("left", "center", "right"), (8, 1, 1))[0]
+        runs = [(" ".join(rnd.choices(WORDS, k=rnd.randint(2, 12))) + " ", rnd.random() < 0.3, rnd.random() < 0.2,
+                 rnd.random() < 0.1, rnd.choice((10, 11, 12, 12, 12, 14, 18, 24))) for _ in range(runs_per_par)]
+        out.append((align, runs))
+    return out
+
+def best_of(fn, repeat=3, setup=None):
+    best = float("inf")
+    for _ in range(repeat):
+        if setup: setup()
+        t0 = time.perf_counter(); fn(); best = min(best, time.perf_counter() - t0)
+    return best
+
+# --- Headless cases ---
+def write_python_docx(path, paragraphs):
+    """The pre-streaming write path: one python-docx run per segment."""
+    from docx import Document
+    from docx.shared import Pt
+    from docx.enum.text import WD_ALIGN_PARAGRAPH
+    a_map = {"center": WD_ALIGN_PARAGRAPH.CENTER, "right": WD_ALIGN_PARAGRAPH.RIGHT, "left": WD_ALIGN_PARAGRAPH.LEFT}
+    doc = Document(); doc.core_properties.identifier = "bench"; doc.core_properties.comments = "2"
+    for align, runs in paragraphs:
+        p = doc.add_paragraph()
+        for text, b, i, u, sz in runs:
+            run = p.add_run(text); run.bold, run.italic, run.underline = b, i, u; run.font.size = Pt(sz)
+            p.alignment = a_map[align]
+    doc.save(path)
+
+def read_python_docx(path):
+    from docx import Document
+    doc = Document(path)
+    return [[(r.text, r.bold, r.italic, r.underline, r.font.size) for r in p.runs] for p in doc.paragraphs]
+
+def bench_docx(results, tmp, sizes, python_docx):
+    for n, r in sizes:
+        model, path = DocumentModel(synthetic_paragraphs(n, r), "bench", "2"), os.path.join(tmp, f"docx_{n}x{r}.docx")
+        results[f"docx_write/{n}x{r}"] = best_of(lambda: model.save(path))
+        results[f"docx_read/{n}x{r}"] = best_of(lambda: DocumentModel.from_docx(path))
+        if python_docx:
+            results[f"python_docx_write/{n}x{r}"] = best_of(lambda: write_python_docx(path, model.paragraphs), 1)
+            results[f"python_docx_read/{n}x{r}"] = best_of(lambda: read_python_docx(path), 1)
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+FIRST_IDLE = """import sys, tkinter as tk
+from script import WordEmulator
+root = tk.Tk(); app = WordEmulator(root, sys.argv[1])
+root.after_idle(app.on_closing)
+root.mainloop()"""
+
+def run_python(code, *args):
+    """Wall time of a fresh interpreter running `code`, as a second launch of the editor would pay it."""
+    t0 = time.perf_counter()
+    out = subprocess.run([sys.executable, "-c", code, *args], cwd=HERE, capture_output=True, text=True)
+    if out.returncode: raise RuntimeError(out.stderr.strip() or f"exit status {out.returncode}")
+    return time.perf_counter() - t0
+
+def bench_startup(results, tmp, display):
+    results["startup/interpreter"] = best_of(lambda: run_python("pass"), 5)
+    results["startup/import"] = best_of(lambda: run_python("import script"), 5)
+    server = InstanceServer(os.path.join(tmp, "instance.json"))
+    handoff = "import sys, script; sys.exit(0 if script.hand_off(sys.argv[1], [sys.argv[2]]) else 1)"
+    results["startup/handoff"] = best_of(lambda: run_python(handoff, server.info_path, os.path.join(tmp, "a.docx")), 5)
+    server.close()
+    if display:
+        data = os.path.join(tmp, "startup"); os.makedirs(data, exist_ok=True)
+        results["startup/first_idle"] = best_of(lambda: run_python(FIRST_IDLE, data), 3)
+
+def bench_journal(results, tmp, sizes, records=1000):
+    """Crash recovery: a chunk checkpoint plus `records` paragraph edits, replayed from disk."""
+    store = BackupStore(os.path.join(tmp, "journal_backups"), os.path.join(tmp, "journal"))
+    os.makedirs(store.journal_dir, exist_ok=True)
+    rnd = random.Random(0)
+    for n, r in sizes:
+        pars = synthetic_paragraphs(n, r)
+        journal = EditJournal(os.path.join(store.journal_dir, f"{n}x{r}.jsonl"), {"checkpoint": {"chunks": store.put_chunks(pars), "pad": True}})
+        for k in range(records):
+            journal.append(rnd.randrange(n), rnd.randrange(2), [("left", [(f"edit {k}", False, False, False, 12)])])
+        journal.close()
+        results[f"journal_replay/{n}x{r}"] = best_of(lambda: EditJournal.replay(journal.path, store))
+    return check_journal_breaks(store)
+
+def check_journal_breaks(store):
+    """Replays an edit on top of a .docx checkpoint whose first paragraph holds a soft break, which the editor
+    shows as two lines. Returns False when the edit lands anywhere but on the line it was made to."""
+    path = os.path.join(store.journal_dir, "breaks.docx")
+    DocumentModel([("left", [("a|b", False, False, False, 12)]), ("left", [("c", False, False, False, 12)])]).save(path)
+    with zipfile.ZipFile(path) as zf: parts = {name: zf.read(name) for name in zf.namelist()}
+    parts["word/document.xml"] = parts["word/document.xml"].replace(b"a|b", b'a</w:t><w:br/><w:t xml:space="preserve">b')
+    with zipfile.ZipFile(path, "w") as zf:
+        for name, data in parts.items(): zf.writestr(name, data)
+    st = os.stat(path)
+    journal = EditJournal(os.path.join(store.journal_dir, "breaks.jsonl"),
+                          {"checkpoint": {"docx": path, "size": st.st_size, "mtime_ns": st.st_mtime_ns, "pad": True}})
+    journal.append(2, 1, [("left", [("cX", False, False, False, 12)])])
+    journal.close()
+    lines = ["".join(r[0] for r in runs) for _, runs in EditJournal.replay(journal.path, store)[1]]
+    if lines != ["a", "b", "cX", ""]: print(f"journal_replay: a document with a soft break replays as {lines}")
+    return lines == ["a", "b", "cX", ""]
+
+def bench_tracer(results, tmp, calls=100_000):
+    """Cost tracing adds to each traced call when it is on; when off nothing is wrapped at all."""
+    tracer = Tracer(os.path.join(tmp, "trace.json"))
+    traced = tracer.wrap("noop", lambda: None)
+    results["trace_overhead/per_call"] = best_of(lambda: [traced() for _ in range(calls)]) / calls
+    tracer.close()
+
+def held_bytes(history):
+    """sys.getsizeof summed over the objects the undo history holds, each counted once."""
+    seen, todo, total = set(), [history.undo_steps, history.redo_steps], 0
+    while todo:
+        o = todo.pop()
+        if id(o) in seen: continue
+        seen.add(id(o)); total += sys.getsizeof(o)
+        if isinstance(o, (list, tuple, deque)): todo.extend(o)
+    return total
+
+def undo_session(history, ops, seed=0, measure_every=0):
+    """A long synthetic editing session against history: typing bursts in one paragraph, restyles of whole
+    sections, large pastes and the odd undo and redo. Returns the most held_bytes seen, sampled every
+    measure_every operations (0: never)."""
+    rnd, pool, peak = random.Random(seed), synthetic_paragraphs(1000, 4, seed), 0
+    def fresh(start, n, k): return [(al, [(f"{t}{k}", b, i, u, sz) for t, b, i, u, sz in runs]) for al, runs in pool[start:start + n]]
+    def undo_redo(redo):
+        step = history.take(redo)
+        if step: history.put(step, redo=not redo)
+    for op in range(ops):
+        kind, at, start = rnd.random(), rnd.randrange(100_000), rnd.randrange(len(pool))
+        if kind < 0.7:
+            old = fresh(start, 1, op)
+            for k in range(rnd.randint(5, 30)): history.record((at, old, fresh(start, 1, k)))
+        elif kind < 0.85:
+            n = rnd.randint(20, 200); history.record((at, fresh(start, n, op), fresh(start, n, -op)))
+        elif kind < 0.95: history.record((at, [], fresh(0, rnd.randint(50, 1000), op)))
+        else: undo_redo(kind < 0.97)
+        history.close()
+        if measure_every and op % measure_every == 0: peak = max(peak, held_bytes(history))
+    return peak
+
+def bench_undo(results, ops=2000):
+    """Returns False when the undo history grows past UNDO_CEILING during the session."""
+    results["undo_session/per_op"] = best_of(lambda: undo_session(UndoHistory(UNDO_CEILING), ops), 1) / ops
+    history = UndoHistory(UNDO_CEILING)
+    peak = undo_session(history, ops, measure_every=10)
+    print(f"undo_session: peak {peak / (1 << 20):.2f} MB held, {len(history.undo_steps)} undo steps, ceiling {UNDO_CEILING / (1 << 20):.0f} MB")
+    if peak > UNDO_CEILING: print(f"undo_session: the history held {peak} bytes, over its {UNDO_CEILING} byte ceiling")
+    return peak <= UNDO_CEILING
+
+# --- Tk cases ---
+def ensure_display():
+    """True when Tk can open a window, starting Xvfb on a headless Linux box if needed."""
+    if os.environ.get("DISPLAY") or sys.platform in ("win32", "darwin"): return True
+    xvfb = shutil.which("Xvfb")
+    if not xvfb: return False
+    for n in range(99, 130):
+        if os.path.exists(f"/tmp/.X11-unix/X{n}"): continue
+        proc = subprocess.Popen([xvfb, f":{n}", "-screen", "0", "1600x1000x24", "-nolisten", "tcp"],
+                                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        time.sleep(0.5)
+        if proc.poll() is None:
+            atexit.register(proc.terminate)
+            os.environ["DISPLAY"] = f":{n}"
+            return True
+    return False
+
+def make_app(data_dir):
+    root = tk.Tk(); root.withdraw()
+    return root, WordEmulator(root, data_dir)
+
+def close_app(root, app):
+    app.writer.close(); app.search.close(); app.index.close(); root.destroy()
+
+def fill_runs(app, chars, runs):
+    """Fills the editor with `chars` characters split into `runs` alternately styled runs."""
+    app.text_area.delete("1.0", tk.END)
+    per_run = max(1, chars // runs)
+    args = []
+    for r in range(runs):
+        args += ["x" * per_run, ("bold", "sz_12") if r % 2 else ("sz_14",)]
+    app.text_area.insert("1.0", *args)
+
+def bench_documents(results, app, tmp, sizes):
+    """Whole-widget cases: the document is loaded in full however large it is."""
+    app.virtual_threshold = None
+    for n, r in sizes:
+        key = f"{n}x{r}"
+        path = os.path.join(tmp, f"doc_{key}.docx")
+        DocumentModel(synthetic_paragraphs(n, r), "", "2").save(path)
+        results[f"load_file/{key}"] = best_of(lambda: app.open_document(path))
+        out = os.path.join(tmp, f"out_{key}.docx")
+        results[f"write_docx/{key}"] = best_of(lambda: app.write_docx(out))
+        results[f"apply_style_to_range/{key}"] = best_of(lambda: app.apply_style_to_range("1.0", "end-1c", toggle_type="italic"))
+        def invalidate(): app.changes.hashes = None
+        results[f"get_fingerprint/full/{key}"] = best_of(app.get_fingerprint, setup=invalidate)
+        def edit_one(): app.text_area.insert(f"{n // 2}.0", "x")
+        results[f"get_fingerprint/one_edit/{key}"] = best_of(app.get_fingerprint, setup=edit_one)
+        def dirty(): app.changes.unmark("backup"); app.writer.wait_idle()
+        results[f"perform_backup/ui/{key}"] = best_of(app.perform_backup, setup=dirty)
+        results[f"perform_backup/total/{key}"] = best_of(lambda: (app.perform_backup(), app.writer.wait_idle()), setup=dirty)
+    app.virtual_threshold = app.VIRTUAL_THRESHOLD
+
+def bench_virtual(results, app, tmp, sizes):
+    """Documents over VIRTUAL_THRESHOLD: the widget holds a window, the rest stays in the paragraph store."""
+    for n, r in sizes:
+        if n <= app.virtual_threshold: continue
+        key = f"{n}x{r}"
+        path = os.path.join(tmp, f"doc_{key}.docx")
+        if not os.path.exists(path): DocumentModel(synthetic_paragraphs(n, r), "", "2").save(path)
+        results[f"load_file/virtual/{key}"] = best_of(lambda: app.open_document(path))
+        def jumps():
+            for k in range(20):
+                app.on_scrollbar("moveto", str(k / 20)); app.text_area.update_idletasks()
+        results[f"scroll/virtual/{key}/per_jump"] = best_of(jumps) / 20
+        def edit_one(): app.text_area.insert("insert linestart", "x")
+        results[f"get_fingerprint/virtual/one_edit/{key}"] = best_of(app.get_fingerprint, setup=edit_one)
+        results[f"write_docx/virtual/{key}"] = best_of(lambda: app.write_docx(os.path.join(tmp, f"out_{key}.docx")))
+        def dirty(): app.changes.unmark("backup"); app.writer.wait_idle()
+        results[f"perform_backup/ui/virtual/{key}"] = best_of(app.perform_backup, setup=dirty)
+        app.writer.wait_idle()
+
+def bench_style_sweep(results, app):
+    """Cost should follow the number of runs, not the number of characters."""
+    for chars, runs in STYLE_SWEEP:
+        results[f"apply_style_to_range/sweep/chars={chars},runs={runs}"] = best_of(
+            lambda: app.apply_style_to_range("1.0", "end-1c", toggle_type="italic"), setup=lambda: fill_runs(app, chars, runs))
+
+def bench_sync_structure(results, app, tmp, folder_versions):
+    for versions in folder_versions:
+        store, pars = app.backup_store, synthetic_paragraphs(200, 4)
+        name, start = f"sync_{versions}", datetime(2020, 1, 1)
+        for v in range(versions):
+            pars[v % 200] = ("left", [(f"edit {v}", False, False, False, 12)])
+            store.save_version(name, pars, "bench", "2", when=start + timedelta(minutes=v))
+        app.file_name, app.current_file_path = name, None
+        t0 = time.perf_counter(); app.sync_structure(os.path.join(tmp, f"{name}_renamed.docx"))
+        results[f"sync_structure/{versions}_versions"] = time.perf_counter() - t0
+
+def replay_keys(app, stream):
+    """Feeds a synthetic key stream through the editor's bindings; returns per-key latency in ms, render included."""
+    ta, lat = app.text_area, []
+    for ch in stream:
+        t0 = time.perf_counter()
+        ta.event_generate("<KeyPress>", keysym=KEYSYMS.get(ch, ch))
+        ta.event_generate("<KeyRelease>", keysym=KEYSYMS.get(ch, ch))
+        ta.update_idletasks()
+        lat.append((time.perf_counter() - t0) * 1000)
+    return lat
+
+def bench_typing(results, app, background_paragraphs=2000):
+    """Returns False when a stream misses the p95 keystroke budget."""
+    ok = True
+    app.root.deiconify()
+    for name, stream in KEY_STREAMS.items():
+        app.show_model(DocumentModel(synthetic_paragraphs(background_paragraphs)))
+        app.text_area.mark_set("insert", f"{background_paragraphs // 2}.0")
+        app.text_area.focus_force(); app.root.update()
+        lat = sorted(replay_keys(app, stream))
+        p95 = lat[int(len(lat) * 0.95)]
+        results[f"typing/{name}/p50"], results[f"typing/{name}/p95"] = lat[len(lat) // 2] / 1000, p95 / 1000
+        if p95 > KEYSTROKE_BUDGET_MS:
+            ok = False; print(f"typing/{name}: p95 {p95:.2f} ms is over the {KEYSTROKE_BUDGET_MS} ms budget")
+    app.root.withdraw()
+    return ok
+
+# --- Reporting ---
+def compare(results, baseline, tolerance):
+    """Prints every case against the baseline; returns the regressed case names."""
+    regressed = []
+    print(f"\n{'case':<58} {'baseline ms':>12} {'now ms':>10} {'ratio':>7}")
+    for case, now in results.items():
+        base = baseline.get(case)
+        if base is None: print(f"{case:<58} {'-':>12} {now * 1000:>10.2f}"); continue
+        ratio = now / base if base else float("inf")
+        bad = ratio > 1 + tolerance and now - base > 0.001
+        if bad: regressed.append(case)
+        print(f"{case:<58} {base * 1000:>12.2f} {now * 1000:>10.2f} {ratio:>7.2f}{'  REGRESSION' if bad else ''}")
+    return regressed
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--full", action="store_true", help="add the 50k/100k-paragraph documents and 10k-version backup folders")
+    parser.add_argument("--only", nargs="*", default=[], help="run only cases whose name starts with one of these prefixes")
+    parser.add_argument("--python-docx", action="store_true", help="also time the old python-docx read/write path (slow; needs pip install python-docx)")
+    parser.add_argument("--out", default="bench_results.json")
+    parser.add_argument("--baseline", help="results file to compare against")
+    parser.add_argument("--save-baseline", help="also write the results to this file")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown before a case counts as a regression")
+    args = parser.parse_args(argv)
+    wanted = lambda prefix: not args.only or any(prefix.startswith(o) or o.startswith(prefix) for o in args.only)
+    sizes = FULL_SIZES if args.full else SIZES
+    results, ok = {}, True
+    with tempfile.TemporaryDirectory() as tmp:
+        if wanted("startup"): bench_startup(results, tmp, ensure_display())
+        if wanted("docx_") or wanted("python_docx_"): bench_docx(results, tmp, sizes, args.python_docx)
+        if wanted("journal_replay"): ok = bench_journal(results, tmp, sizes) and ok
+        if wanted("trace_overhead"): bench_tracer(results, tmp)
+        if wanted("undo_session"): ok = bench_undo(results) and ok
+        tk_cases = ("load_file", "write_docx", "apply_style_to_range", "get_fingerprint", "perform_backup", "sync_structure", "typing", "scroll")
+        if any(wanted(c) for c in tk_cases):
+            if ensure_display():
+                root, app = make_app(tmp)
+                if any(wanted(c) for c in tk_cases[:5]): bench_documents(results, app, tmp, sizes)
+                if any(wanted(c) for c in tk_cases[:5] + ("scroll",)): bench_virtual(results, app, tmp, sizes)
+                if wanted("apply_style_to_range/sweep"): bench_style_sweep(results, app)
+                if wanted("sync_structure"): bench_sync_structure(results, app, tmp, FULL_BACKUP_FOLDER_VERSIONS if args.full else BACKUP_FOLDER_VERSIONS)
+                if wanted("typing"): ok = bench_typing(results, app) and ok
+                close_app(root, app)
+            else: print("No display and no Xvfb: skipping the Tk benchmarks", file=sys.stderr)
+    results = {k: v for k, v in results.items() if wanted(k)}
+    report = {"created": datetime.now().isoformat(timespec="seconds"), "python": platform.python_version(),
+              "platform": platform.platform(), "tk": tk.TkVersion, "results": results}
+    for path in filter(None, (args.out, args.save_baseline)):
+        with open(path, "w") as f: json.dump(report, f, indent=2)
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as f: baseline = json.load(f)["results"]
+    regressed = compare(results, baseline, args.tolerance)
+    if regressed: print(f"\n{len(regressed)} regression(s) beyond {args.tolerance:.0%}")
+    return 1 if regressed or not ok else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -2,12 +2,24 @@ import tkinter as tk
 from tkinter import ttk, filedialog, messagebox
 import json
 import os
+import hashlib
+import sqlite3
+import socket
+import secrets
 import uuid
 import re
-from datetime import datetime
-from docx import Document
-from docx.shared import Pt
-from docx.enum.text import WD_ALIGN_PARAGRAPH
+import sys
+import time
+import queue
+import threading
+import zipfile
+import zlib
+import bisect
+import xml.etree.ElementTree as ET
+from collections import Counter, OrderedDict, deque
+if os.name == "nt": import msvcrt
+else: import fcntl
+from datetime import datetime, timezone
 
 class ToolTip:
     """Class to create a hover tooltip for a widget."""
@@ -38,56 +50,1310 @@ class ToolTip:
         if tw:
             tw.destroy()
 
+STYLE_TAGS = ("bold", "italic", "underline")
+ALIGN_TAGS = ("left", "center", "right")
+
+def is_style_tag(tag):
+    return tag in STYLE_TAGS or tag.startswith("sz_") or tag.startswith("comp_")
+
+def is_doc_tag(tag):
+    return is_style_tag(tag) or tag in ALIGN_TAGS
+
+def font_tag_name(size, bold, italic):
+    return f"comp_{size}_{'b' if bold else ''}{'i' if italic else ''}"
+
+def style_tags(bold, italic, underline, size):
+    """All style tags a character with this style carries in the editor."""
+    return tuple(t for t in ("bold" if bold else None, "italic" if italic else None, "underline" if underline else None,
+                             f"sz_{size}", font_tag_name(size, bold, italic)) if t)
+
+def size_of_tags(tags, default=12):
+    for t in tags:
+        if t.startswith("sz_"): return int(t.split("_")[1])
+    return default
+
+def dump_segments(dump, active=()):
+    """Turns a Text.dump(text=True, tag=True) result into [(text, doc_tags)] segments; active are the tags on at the start."""
+    active, segments = set(active), []
+    for kind, val, _ in dump:
+        if kind == "tagon": active.add(val)
+        elif kind == "tagoff": active.discard(val)
+        elif kind == "text": segments.append((val, tuple(t for t in active if is_doc_tag(t))))
+    return segments
+
+def fingerprint_of(segments):
+    """Canonical document form: adjacent segments with the same tags merged, so dumps and load segments compare equal."""
+    fp, parts, key = [], [], None
+    for text, tags in segments:
+        if not text: continue
+        k = frozenset(tags)
+        if k != key and parts: fp.append(("".join(parts), key)); parts = []
+        key = k; parts.append(text)
+    if parts: fp.append(("".join(parts), key))
+    return fp
+
+def line_hashes(segments):
+    """One hash per line (paragraph) of the canonical segment form; the newlines themselves aren't hashed."""
+    hashes, line = [], []
+    for text, tags in segments:
+        for i, part in enumerate(text.split("\n")):
+            if i: hashes.append(hash(tuple(fingerprint_of(line)))); line = []
+            if part: line.append((part, tags))
+    hashes.append(hash(tuple(fingerprint_of(line))))
+    return hashes
+
+# --- Streaming .docx serialization ---
+# A document is a list of paragraphs (align, [(text, bold, italic, underline, size)]).
+W = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+DC = "{http://purl.org/dc/elements/1.1/}"
+REL_OFFICE_DOC = "http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument"
+REL_CORE_PROPS = "http://schemas.openxmlformats.org/package/2006/relationships/metadata/core-properties"
+XML_HEAD = '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+CONTENT_TYPES_XML = XML_HEAD + (
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/word/document.xml" ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"/>'
+    '<Override PartName="/docProps/core.xml" ContentType="application/vnd.openxmlformats-package.core-properties+xml"/></Types>')
+PACKAGE_RELS_XML = XML_HEAD + (
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    f'<Relationship Id="rId1" Type="{REL_OFFICE_DOC}" Target="word/document.xml"/>'
+    f'<Relationship Id="rId2" Type="{REL_CORE_PROPS}" Target="docProps/core.xml"/></Relationships>')
+DOCUMENT_RELS_XML = XML_HEAD + '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships"/>'
+DOCUMENT_HEAD = XML_HEAD + '<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main"><w:body>'
+DOCUMENT_TAIL = ('<w:sectPr><w:pgSz w:w="12240" w:h="15840"/>'
+                 '<w:pgMar w:top="1440" w:right="1440" w:bottom="1440" w:left="1440" w:header="720" w:footer="720" w:gutter="0"/>'
+                 '</w:sectPr></w:body></w:document>')
+
+def escape(text):
+    """XML-escapes character data (xml.sax.saxutils.escape pulls in urllib at import time)."""
+    return text.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+
+INVALID_XML_CHARS = re.compile("[\x00-\x08\x0b\x0c\x0e-\x1f]")
+
+def segments_to_paragraphs(segments):
+    """Groups [(text, tags)] segments into paragraphs, merging neighbouring runs with the same formatting."""
+    paragraphs, align, runs = [], "left", []
+    def add_run(text, tags):
+        nonlocal align
+        for a in ALIGN_TAGS:
+            if a in tags: align = a
+        fmt = ("bold" in tags, "italic" in tags, "underline" in tags, size_of_tags(tags))
+        if runs and runs[-1][1:] == fmt: runs[-1] = (runs[-1][0] + text,) + fmt
+        else: runs.append((text,) + fmt)
+    for text, tags in segments:
+        lines = text.split("\n")
+        for i, line in enumerate(lines):
+            if i:
+                paragraphs.append((align, runs)); align, runs = "left", []
+            if line: add_run(line, tags)
+    paragraphs.append((align, runs))
+    return paragraphs
+
+def _run_xml(text, bold, italic, underline, size):
+    rpr = ("<w:b/>" if bold else "") + ("<w:i/>" if italic else "") + ('<w:u w:val="single"/>' if underline else "") + f'<w:sz w:val="{size * 2}"/>'
+    body = "<w:tab/>".join(f'<w:t xml:space="preserve">{escape(part)}</w:t>' if part else "" for part in INVALID_XML_CHARS.sub("", text).split("\t"))
+    return f"<w:r><w:rPr>{rpr}</w:rPr>{body}</w:r>"
+
+def write_docx_stream(path, paragraphs, identifier="", comments="", flush_at=1 << 16):
+    """Writes paragraphs straight into a .docx zip, streaming word/document.xml in chunks."""
+    modified = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+    core = XML_HEAD + (
+        '<cp:coreProperties xmlns:cp="http://schemas.openxmlformats.org/package/2006/metadata/core-properties" '
+        'xmlns:dc="http://purl.org/dc/elements/1.1/" xmlns:dcterms="http://purl.org/dc/terms/" '
+        'xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance">'
+        f'<dc:identifier>{escape(identifier or "")}</dc:identifier><dc:description>{escape(comments or "")}</dc:description>'
+        f'<dcterms:modified xsi:type="dcterms:W3CDTF">{modified}</dcterms:modified></cp:coreProperties>')
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr("[Content_Types].xml", CONTENT_TYPES_XML)
+        zf.writestr("_rels/.rels", PACKAGE_RELS_XML)
+        zf.writestr("docProps/core.xml", core)
+        zf.writestr("word/_rels/document.xml.rels", DOCUMENT_RELS_XML)
+        with zf.open("word/document.xml", "w") as f:
+            buf, size = [DOCUMENT_HEAD], 0
+            for align, runs in paragraphs:
+                ppr = f'<w:pPr><w:jc w:val="{align}"/></w:pPr>' if align != "left" else ""
+                chunk = f"<w:p>{ppr}{''.join(_run_xml(*r) for r in runs)}</w:p>"
+                buf.append(chunk); size += len(chunk)
+                if size >= flush_at:
+                    f.write("".join(buf).encode("utf-8")); buf, size = [], 0
+            buf.append(DOCUMENT_TAIL)
+            f.write("".join(buf).encode("utf-8"))
+
+def _flag(rpr, name):
+    el = rpr.find(W + name) if rpr is not None else None
+    return el is not None and el.get(W + "val", "true") not in ("0", "false", "off", "none")
+
+def _read_paragraph(p):
+    jc = p.find(f"{W}pPr/{W}jc")
+    align = {"center": "center", "right": "right", "end": "right"}.get(jc.get(W + "val") if jc is not None else None, "left")
+    runs = []
+    for r in p.iter(W + "r"):
+        parts = []
+        for c in r:
+            if c.tag == W + "t": parts.append(c.text or "")
+            elif c.tag == W + "tab": parts.append("\t")
+            elif c.tag in (W + "br", W + "cr"): parts.append("\n")
+        text = "".join(parts)
+        if not text: continue
+        rpr = r.find(W + "rPr")
+        sz = rpr.find(W + "sz") if rpr is not None else None
+        fmt = (_flag(rpr, "b"), _flag(rpr, "i"), _flag(rpr, "u"), int(sz.get(W + "val")) // 2 if sz is not None else 12)
+        if runs and runs[-1][1:] == fmt: runs[-1] = (runs[-1][0] + text,) + fmt
+        else: runs.append((text,) + fmt)
+    return align, runs
+
+def read_docx_stream(path):
+    """Reads a .docx without building a document tree. Returns (paragraphs, identifier, comments)."""
+    with zipfile.ZipFile(path) as zf:
+        targets = {"main": "word/document.xml", "core": "docProps/core.xml"}
+        try:
+            for rel in ET.fromstring(zf.read("_rels/.rels")):
+                if rel.get("Type") == REL_OFFICE_DOC: targets["main"] = rel.get("Target").lstrip("/")
+                elif rel.get("Type") == REL_CORE_PROPS: targets["core"] = rel.get("Target").lstrip("/")
+        except KeyError: pass
+        identifier = comments = ""
+        if targets["core"] in zf.namelist():
+            core = ET.fromstring(zf.read(targets["core"]))
+            identifier = core.findtext(DC + "identifier") or ""
+            comments = core.findtext(DC + "description") or ""
+        paragraphs, stack = [], []
+        with zf.open(targets["main"]) as f:
+            for event, el in ET.iterparse(f, events=("start", "end")):
+                if event == "start": stack.append(el.tag); continue
+                stack.pop()
+                if el.tag == W + "p" and stack and stack[-1] == W + "body":
+                    paragraphs.append(_read_paragraph(el)); el.clear()
+                elif el.tag == W + "tbl": el.clear()
+    return paragraphs, identifier, comments
+
+class DocumentModel:
+    """A document without any widget: paragraphs of styled runs plus the metadata NonnoWord keeps in core properties.
+
+    paragraphs is [(align, [(text, bold, italic, underline, size)])]; doc_id and backup_minutes round-trip through
+    dc:identifier and dc:description. The editor builds its Text contents from a model and hands one back for
+    saving, so loading, saving, fingerprinting and batch conversion all run without Tk.
+    """
+    def __init__(self, paragraphs=None, doc_id="", backup_minutes=""):
+        self.paragraphs = paragraphs if paragraphs is not None else [("left", [])]
+        self.doc_id = doc_id
+        self.backup_minutes = backup_minutes
+
+    @classmethod
+    def from_docx(cls, path):
+        return cls(*read_docx_stream(path))
+
+    @classmethod
+    def from_segments(cls, segments, doc_id="", backup_minutes=""):
+        return cls(segments_to_paragraphs(segments), doc_id, backup_minutes)
+
+    @classmethod
+    def from_dump(cls, dump, doc_id="", backup_minutes=""):
+        """From a Text.dump(text=True, tag=True) result, as taken by WordEmulator.snapshot."""
+        return cls.from_segments(dump_segments(dump), doc_id, backup_minutes)
+
+    @classmethod
+    def from_snapshot(cls, snapshot):
+        """From a WordEmulator.snapshot(): (dump, doc_id, backup_minutes), where for a windowed document the dump is
+        (paragraphs before the window, dump of the window, paragraphs after it)."""
+        body, doc_id, backup_minutes = snapshot
+        if isinstance(body, tuple):
+            head, dump, tail = body
+            return cls(head + segments_to_paragraphs(dump_segments(dump)) + tail, doc_id, backup_minutes)
+        return cls.from_dump(body, doc_id, backup_minutes)
+
+    def segments(self):
+        """[(text, tags)] segments with the tag names the editor uses, one newline per paragraph."""
+        segments = []
+        for al, runs in self.paragraphs:
+            for text, b, i, u, sz in runs:
+                segments.append((text, style_tags(b, i, u, sz) + (al,)))
+            segments.append(("\n", ()))
+        return segments
+
+    def lines(self):
+        """Paragraphs laid out as the editor holds them, one per widget line: a soft break inside a run starts a
+        new line, and the trailing empty line is included. Lines up with fingerprint()."""
+        if any("\n" in r[0] for _, runs in self.paragraphs for r in runs): return segments_to_paragraphs(self.segments())
+        return self.paragraphs + [("left", [])]
+
+    def fingerprint(self):
+        """Per-line hashes, comparable with WordEmulator.get_fingerprint for the same content."""
+        return tuple(line_hashes(self.segments()))
+
+    def text(self):
+        return "\n".join("".join(r[0] for r in runs) for _, runs in self.paragraphs)
+
+    def normalize(self):
+        """Drops empty runs and trailing empty paragraphs, merges runs with equal formatting, cleans values."""
+        out = []
+        for al, runs in self.paragraphs:
+            merged = []
+            for text, b, i, u, sz in runs:
+                text = INVALID_XML_CHARS.sub("", text)
+                if not text: continue
+                fmt = (bool(b), bool(i), bool(u), min(max(int(sz), 1), 1638))
+                if merged and merged[-1][1:] == fmt: merged[-1] = (merged[-1][0] + text,) + fmt
+                else: merged.append((text,) + fmt)
+            out.append((al if al in ALIGN_TAGS else "left", merged))
+        while len(out) > 1 and not out[-1][1]: out.pop()
+        self.paragraphs = out
+        return self
+
+    def save(self, path):
+        """Writes the model via a temporary file and an atomic rename."""
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            write_docx_stream(tmp, self.paragraphs, self.doc_id, self.backup_minutes)
+            os.replace(tmp, path)
+        except BaseException:
+            try: os.remove(tmp)
+            except OSError: pass
+            raise
+
+class ParagraphStore:
+    """A document too large for the Text widget: its paragraphs and their line hashes, with the editor showing a window.
+
+    Paragraphs are laid out as the widget would hold them, trailing empty line included, so hashes and snapshots
+    match a fully loaded document. Edits in the window are spliced back in when it moves.
+    """
+    def __init__(self, paragraphs, hashes):
+        self.paragraphs = paragraphs
+        self.hashes = hashes
+
+    @classmethod
+    def from_model(cls, model):
+        return cls(model.lines(), list(model.fingerprint()))
+
+    def __len__(self):
+        return len(self.paragraphs)
+
+    def segments(self, start, end):
+        """Segments of paragraphs [start, end), newlines between them but not after the last."""
+        return DocumentModel(self.paragraphs[start:end]).segments()[:-1]
+
+    def splice(self, start, count, paragraphs, hashes):
+        self.paragraphs[start:start + count] = paragraphs
+        self.hashes[start:start + count] = hashes
+
+    def has_text(self, skip_start=0, skip_count=0):
+        """True when a paragraph outside [skip_start, skip_start + skip_count) has non-blank text."""
+        pars = self.paragraphs
+        return any(text.strip() for part in (pars[:skip_start], pars[skip_start + skip_count:]) for _, runs in part for text, *_ in runs)
+
+class StyleEngine:
+    """Applies character styles to a Text widget run by run instead of character by character."""
+    def __init__(self, text):
+        self.text = text
+        self.font_tags = {}  # (size, bold, italic) -> configured comp_ tag
+        self.text.tag_configure("underline", underline=True)
+
+    def font_tag(self, size, bold, italic):
+        key = (size, bool(bold), bool(italic))
+        tag = self.font_tags.get(key)
+        if tag is None:
+            tag = font_tag_name(size, bold, italic)
+            st_l = ["bold" if bold else None, "italic" if italic else None]
+            self.text.tag_configure(tag, font=("Calibri", size, " ".join(filter(None, st_l))))
+            self.font_tags[key] = tag
+        return tag
+
+    def configure_paragraphs(self, paragraphs):
+        """Configures the font tags paragraphs' runs need, before they are inserted with bare tag names."""
+        for _, runs in paragraphs:
+            for _, b, i, _, sz in runs: self.font_tag(sz, b, i)
+
+    def tags_for(self, bold, italic, underline, size):
+        """style_tags(), making sure the font tag among them is configured."""
+        self.font_tag(size, bold, italic)
+        return style_tags(bold, italic, underline, size)
+
+    def runs(self, start, end):
+        """Splits [start, end) into (start, end, style_tags) runs where the style tags don't change."""
+        start, end = self.text.index(start), self.text.index(end)
+        if self.text.compare(start, ">=", end): return []
+        active = {t for t in self.text.tag_names(start) if is_style_tag(t)}
+        runs, run_st = [], start
+        for kind, tag, idx in self.text.dump(start, end, tag=True):
+            if not is_style_tag(tag): continue
+            if idx != run_st:
+                runs.append((run_st, idx, frozenset(active))); run_st = idx
+            if kind == "tagon": active.add(tag)
+            else: active.discard(tag)
+        if run_st != end: runs.append((run_st, end, frozenset(active)))
+        return runs
+
+    def apply(self, start, end, style_for):
+        """Restyles every run with style_for(tags) -> (bold, italic, underline, size), one tag call per tag."""
+        runs = self.runs(start, end)
+        if not runs: return 0
+        ranges = {}
+        for st, en, tags in runs:
+            for t in self.tags_for(*style_for(tags)):
+                idxs = ranges.setdefault(t, [])
+                if idxs and idxs[-1] == st: idxs[-1] = en
+                else: idxs.extend((st, en))
+        for t in set().union(*(tags for _, _, tags in runs)):
+            self.text.tag_remove(t, runs[0][0], runs[-1][1])
+        for t, idxs in ranges.items(): self.text.tag_add(t, *idxs)
+        return len(runs)
+
+class ChangeTracker:
+    """Tracks edits to a Text widget through a Tcl proxy around its widget command.
+
+    Every insert/delete/replace, document tag change and undo/redo bumps a version counter, so asking whether
+    anything changed since a mark is O(1). One hash per paragraph is kept as well; edits only invalidate the
+    lines they touch and those are rehashed on demand, which tells which paragraphs changed since a mark.
+    When the widget holds a window of a ParagraphStore, the store supplies the hashes outside it.
+    """
+    PROXY = """proc %(w)s args {
+    set op [lindex $args 0]
+    if {$op in {insert delete replace} || ($op eq "tag" && [lindex $args 1] in {add remove}) || ($op eq "edit" && [lindex $args 1] in {undo redo})} {
+        %(before)s {*}$args
+        set r [uplevel 1 [list %(orig)s {*}$args]]
+        %(after)s
+        return $r
+    }
+    uplevel 1 [list %(orig)s {*}$args]
+}"""
+
+    def __init__(self, text):
+        self.text = text
+        self.orig = text._w + "_orig"
+        self.version = 0
+        self.marks = {}      # name -> (version, tuple of paragraph hashes in order)
+        self.hashes = None   # None: rehash everything; None entries: lines rehashed on the next flush
+        self.span = None     # (first, last) lines that may hold None entries
+        self.window = None   # (store, first paragraph, paragraphs the store holds for the window)
+        self.paused = False  # window swaps aren't edits
+        self.pending = None
+        text.tk.call("rename", text._w, self.orig)
+        text.tk.eval(self.PROXY % {"w": text._w, "orig": self.orig, "before": text.register(self.before_edit), "after": text.register(self.after_edit)})
+
+    def line_of(self, index):
+        return int(self.text.tk.call(self.orig, "index", index).split(".")[0])
+
+    def before_edit(self, op, *args):
+        if self.paused: self.pending = None; return
+        try:
+            last = self.line_of("end-1c")
+            if op == "edit": self.pending = "all"
+            elif op == "tag":
+                if not is_doc_tag(args[1]): self.pending = None; return
+                lines = [self.line_of(i) for i in args[2:]]
+                self.pending = (min(lines), max(lines), last)
+            elif op == "insert":
+                first = min(self.line_of(args[0]), last); self.pending = (first, first, last)
+            else:
+                idx = args[:2] if op == "replace" else (args if len(args) > 1 else (args[0], args[0] + " +1c"))
+                lines = [min(self.line_of(i), last) for i in idx]
+                self.pending = (min(lines), max(lines), last)
+        except Exception: self.pending = "all"
+
+    def after_edit(self):
+        p, self.pending = self.pending, None
+        if p is None: return
+        self.version += 1
+        self.text.tk.call(self.orig, "edit", "modified", 1)
+        if p == "all" or self.hashes is None: self.hashes = None; return
+        first, last, old_last = p
+        try: end = self.line_of("end-1c")
+        except Exception: self.hashes = None; return
+        delta = end - old_last
+        self.hashes[first - 1:last] = [None] * (last - first + 1 + delta)
+        if self.span:
+            s0, s1 = self.span  # lines after the edit shift by delta; lines inside it collapse onto its end
+            s1 = s1 + delta if s1 >= last else last + delta if s1 >= first else s1
+            self.span = (min(s0, first, end), min(max(s1, last + delta), end))
+        else: self.span = (min(first, end), min(last + delta, end))
+
+    def flush_lines(self):
+        """Rehashes the lines edits invalidated and returns the hashes of the widget's lines."""
+        if self.hashes is None:
+            self.hashes = line_hashes(dump_segments(self.text.dump("1.0", "end-1c", text=True, tag=True)))
+        elif self.span:
+            first, last = self.span
+            dump = self.text.dump(f"{first}.0", f"{last}.end", text=True, tag=True)
+            self.hashes[first - 1:last] = line_hashes(dump_segments(dump, self.text.tag_names(f"{first}.0")))
+        self.span = None
+        return self.hashes
+
+    def flush(self):
+        """Per-paragraph hashes of the whole document."""
+        hashes = self.flush_lines()
+        if not self.window: return hashes
+        store, start, count = self.window
+        return store.hashes[:start] + hashes + store.hashes[start + count:]
+
+    def reset(self, hashes=None):
+        """Forgets all marks, e.g. for a new or freshly loaded document whose hashes may be passed in."""
+        self.hashes, self.span, self.marks, self.window = hashes, None, {}, None
+        self.text.edit_modified(False)
+
+    def rebase(self, window, hashes):
+        """Follows the widget to another window of a store; the swap itself doesn't count as an edit."""
+        self.window, self.hashes, self.span = window, hashes, None
+
+    def mark(self, name):
+        hashes = self.flush()
+        self.marks[name] = (self.version, tuple(hashes))
+        if name == "save": self.text.edit_modified(False)
+
+    def unmark(self, name):
+        self.marks.pop(name, None)
+
+    def changed(self, name):
+        """O(1): has anything been edited since mark(name)?"""
+        m = self.marks.get(name)
+        return m is None or m[0] != self.version
+
+    def changed_paragraphs(self, name):
+        """Indices of paragraphs whose content (text and formatting) isn't in the document as it was at mark(name),
+        each paragraph there accounting for one paragraph now: of two blank paragraphs where one was, one changed."""
+        hashes, m = self.flush(), self.marks.get(name)
+        if m is None: return list(range(len(hashes)))
+        left, changed = Counter(m[1]), []
+        for i, h in enumerate(hashes):
+            if left[h]: left[h] -= 1
+            else: changed.append(i)
+        return changed
+
+    def same_as(self, name):
+        """True when edits since mark(name) cancelled out, e.g. typing followed by deleting; paragraphs that were
+        only moved or swapped count as a change."""
+        m = self.marks.get(name)
+        return m is not None and (not self.changed(name) or tuple(self.flush()) == m[1])
+
+class BackgroundWriter:
+    """Serializes editor snapshots and writes them to disk on a worker thread.
+
+    Jobs are keyed (e.g. ("backup", doc_id)); a newer job for a queued key replaces the older one, which it
+    supersedes. Jobs for other keys are never dropped, as the UI has already marked them done (a save in particular).
+    Outcomes land in `results` for the Tk thread to pick up.
+    """
+    def __init__(self):
+        self.pending = OrderedDict()  # key -> (label, fn, args)
+        self.results = queue.Queue()  # (key, label, error or None, seconds)
+        self.cond = threading.Condition()
+        self.running, self.closed = None, False  # key of the job being written
+        self.thread = threading.Thread(target=self.run, name="backup-writer", daemon=True)
+        self.thread.start()
+
+    def submit(self, key, label, fn, *args):
+        with self.cond:
+            self.pending.pop(key, None)
+            self.pending[key] = (label, fn, args)
+            self.cond.notify()
+
+    def cancel(self, key):
+        """Drops the queued job for key and waits out one being written, e.g. before writing the same file inline,
+        so an older snapshot can't land on top of it."""
+        with self.cond:
+            self.pending.pop(key, None)
+            self.cond.wait_for(lambda: self.running != key)
+
+    def run(self):
+        while True:
+            with self.cond:
+                while not self.pending and not self.closed: self.cond.wait()
+                if not self.pending: return
+                key, (label, fn, args) = self.pending.popitem(last=False)
+                self.running = key
+            t0, err = time.perf_counter(), None
+            try: fn(*args)
+            except Exception as e: err = e
+            self.results.put((key, label, err, time.perf_counter() - t0))
+            with self.cond:
+                self.running = None; self.cond.notify_all()
+
+    def idle(self):
+        with self.cond: return not self.pending and self.running is None
+
+    def wait_idle(self, timeout=None):
+        with self.cond: return self.cond.wait_for(lambda: not self.pending and self.running is None, timeout)
+
+    def close(self, timeout=None):
+        """Finishes the queued writes and stops the thread."""
+        with self.cond:
+            self.closed = True; self.cond.notify_all()
+        self.thread.join(timeout)
+
+class BackupStore:
+    """Deduplicated backup history.
+
+    A version is cut into chunks of paragraphs at content-defined boundaries, so an edit only produces new
+    chunks around it. Chunks are stored once, zlib-compressed and keyed by SHA-1, under backups/.objects/ and
+    shared by all documents; a version itself is just backups/<name>/<YYYYmmddHHMM>.json listing its chunks.
+    """
+    # (max age in seconds, keep one version per bucket of this many seconds; 0 keeps every version)
+    RETENTION = ((3600, 0), (86400, 3600), (None, 86400))
+    CHUNK_MASK = 0xF       # a paragraph whose CRC ends in these bits closes its chunk: ~16 paragraphs per chunk
+    CHUNK_MAX = 1 << 16
+    GC_EVERY = 50          # pruned versions between garbage collections
+    GC_GRACE = 3600        # never collect objects younger than this; another instance may be mid-backup
+
+    def __init__(self, root, journal_dir=None):
+        self.root = root
+        self.objects = os.path.join(root, ".objects")
+        self.journal_dir = journal_dir  # edit journal checkpoints keep their chunks alive too
+        self.pruned_since_gc = 0
+
+    def object_path(self, h):
+        return os.path.join(self.objects, h[:2], h[2:])
+
+    def put(self, data):
+        h = hashlib.sha1(data).hexdigest()
+        path = self.object_path(h)
+        if os.path.exists(path):
+            os.utime(path) # Keeps the shared chunk out of a concurrent garbage collection
+            return h
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f: f.write(zlib.compress(data))
+        os.replace(tmp, path)
+        return h
+
+    def get(self, h):
+        with open(self.object_path(h), "rb") as f: return zlib.decompress(f.read())
+
+    def chunks(self, paragraphs):
+        """Yields each chunk as the JSON bytes of its paragraph list."""
+        buf, size = [], 0
+        for align, runs in paragraphs:
+            p = json.dumps([align, runs], ensure_ascii=False, separators=(",", ":"))
+            buf.append(p); size += len(p)
+            if zlib.crc32(p.encode("utf-8")) & self.CHUNK_MASK == self.CHUNK_MASK or size >= self.CHUNK_MAX:
+                yield ("[" + ",".join(buf) + "]").encode("utf-8"); buf, size = [], 0
+        if buf: yield ("[" + ",".join(buf) + "]").encode("utf-8")
+
+    def put_chunks(self, paragraphs):
+        return [self.put(c) for c in self.chunks(paragraphs)]
+
+    def load_chunks(self, chunks):
+        return [(align, [tuple(r) for r in runs]) for h in chunks for align, runs in json.loads(self.get(h))]
+
+    def save_version(self, name, paragraphs, identifier="", comments="", when=None):
+        when = when or datetime.now()
+        manifest = {"identifier": identifier, "comments": comments, "created": when.isoformat(timespec="seconds"),
+                    "chunks": self.put_chunks(paragraphs)}
+        folder = os.path.join(self.root, name)
+        os.makedirs(folder, exist_ok=True)
+        path = os.path.join(folder, f"{when.strftime('%Y%m%d%H%M')}.json")
+        with open(path + ".tmp", "w", encoding="utf-8") as f: json.dump(manifest, f, separators=(",", ":"))
+        os.replace(path + ".tmp", path)
+        return path
+
+    def backup(self, name, snapshot):
+        """Worker-thread entry point: stores an editor snapshot as a new version and thins the history.
+        Returns (manifest path, manifest paths pruned)."""
+        model = DocumentModel.from_snapshot(snapshot)
+        path = self.save_version(name, model.paragraphs, model.doc_id, model.backup_minutes)
+        removed = self.prune(name)
+        self.pruned_since_gc += len(removed)
+        if self.pruned_since_gc >= self.GC_EVERY: self.collect_garbage(); self.pruned_since_gc = 0
+        return path, removed
+
+    def versions(self, name):
+        """[(timestamp, manifest path)] of a document, oldest first."""
+        folder, out = os.path.join(self.root, name), []
+        if not os.path.isdir(folder): return out
+        for f in os.listdir(folder):
+            match = re.match(r"(\d{12})\.json$", f)
+            if match: out.append((datetime.strptime(match.group(1), "%Y%m%d%H%M").timestamp(), os.path.join(folder, f)))
+        return sorted(out)
+
+    def load_version(self, manifest_path):
+        """Returns (paragraphs, identifier, comments) of a stored version."""
+        with open(manifest_path, encoding="utf-8") as f: manifest = json.load(f)
+        return self.load_chunks(manifest["chunks"]), manifest.get("identifier", ""), manifest.get("comments", "")
+
+    def export(self, manifest_path, out_path):
+        DocumentModel(*self.load_version(manifest_path)).save(out_path)
+
+    def prune(self, name, now=None):
+        """Applies RETENTION to a document's versions, keeping the newest one per bucket. Returns the removed paths."""
+        now, seen, removed = now or time.time(), set(), []
+        for ts, path in reversed(self.versions(name)):
+            age = now - ts
+            tier = next(i for i, (max_age, _) in enumerate(self.RETENTION) if max_age is None or age < max_age)
+            bucket = self.RETENTION[tier][1]
+            if not bucket: continue
+            key = (tier, int(ts // bucket))
+            if key not in seen: seen.add(key); continue
+            try: os.remove(path); removed.append(path)
+            except OSError: pass
+        return removed
+
+    def collect_garbage(self):
+        """Deletes chunks no manifest or journal checkpoint refers to any more."""
+        live = set()
+        for name in os.listdir(self.root):
+            if name == ".objects" or not os.path.isdir(os.path.join(self.root, name)): continue
+            for _, path in self.versions(name):
+                try:
+                    with open(path, encoding="utf-8") as f: live.update(json.load(f)["chunks"])
+                except (OSError, ValueError, KeyError): pass
+        for f in os.listdir(self.journal_dir) if self.journal_dir and os.path.isdir(self.journal_dir) else ():
+            try:
+                with open(os.path.join(self.journal_dir, f), "rb") as j: live.update(json.loads(j.readline())["checkpoint"].get("chunks", ()))
+            except (OSError, ValueError, KeyError, AttributeError): pass
+        if not os.path.isdir(self.objects): return 0
+        cutoff, removed = time.time() - self.GC_GRACE, 0
+        for d in os.listdir(self.objects):
+            for f in os.listdir(os.path.join(self.objects, d)):
+                path = os.path.join(self.objects, d, f)
+                if d + f not in live and os.path.getmtime(path) < cutoff:
+                    try: os.remove(path); removed += 1
+                    except OSError: pass
+        return removed
+
+    def rename(self, old_name, new_name):
+        """Moves a document's history; manifests are named by timestamp only, so this is one directory rename.
+        Returns False, moving nothing, when there is no history or the new name already has one."""
+        old_dir, new_dir = os.path.join(self.root, old_name), os.path.join(self.root, new_name)
+        if not os.path.exists(old_dir) or os.path.exists(new_dir): return False
+        os.rename(old_dir, new_dir)
+        for f in os.listdir(new_dir):
+            # Backups from before the store were whole .docx files named [Prefix]_[12 Digits].docx
+            match = re.match(r"(.+)_(\d{12})\.docx$", f)
+            if match:
+                try: os.rename(os.path.join(new_dir, f), os.path.join(new_dir, f"{new_name}_{match.group(2)}.docx"))
+                except OSError: pass
+        return True
+
+def try_lock(path):
+    """Opens path, created if need be, and takes an exclusive OS lock on it without waiting. Returns the open file,
+    which holds the lock until release_lock, or None when another process holds it."""
+    f = open(path, "a+b")
+    try:
+        if os.name == "nt": f.seek(0); msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+        else: fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return f
+    except OSError:
+        f.close(); return None
+
+def release_lock(f, path):
+    """Removes a lock file taken with try_lock and lets go of it. POSIX removes it while still locked, so nobody
+    locks a file that is about to vanish; Windows can only remove it once closed."""
+    try: os.remove(path)
+    except OSError: pass
+    f.close()
+    if os.name == "nt":
+        try: os.remove(path)
+        except OSError: pass
+
+class EditJournal:
+    """Write-ahead log of one document's edits, so a crash costs well under a second of typing.
+
+    journal/<doc_id>.jsonl starts with a header naming a checkpoint (chunks in the backup object store, the .docx
+    just opened, or inline paragraphs) and the last record it includes. Every further line is a numbered splice
+    {"n", "at", "del", "pars"} replacing paragraphs, which covers insertions, deletions and restyles alike.
+    Records are written and fsynced in batches on a worker thread; a successful save or backup compacts the file
+    to a new checkpoint. A clean shutdown removes the file, so a journal found at startup means a crash, unless
+    <doc_id>.lock beside it is still locked: the writing editor (whose pid the header names) holds that lock while
+    the journal is open, and recovery holds it while replaying.
+    """
+    SYNC_INTERVAL = 0.5  # seconds of records gathered into one write and fsync
+
+    def __init__(self, path, header):
+        self.path = path
+        self.lock = try_lock(self.lock_path(path))
+        self.cond = threading.Condition()  # guards pending, seq and closed
+        self.io = threading.Lock()         # guards the file; taken before cond
+        self.pending, self.seq, self.base, self.closed, self.file = [], 0, 0, False, None
+        self.rewrite(dict(header, seq=0), [])
+        self.thread = threading.Thread(target=self.run, name="edit-journal", daemon=True)
+        self.thread.start()
+
+    @staticmethod
+    def lock_path(path):
+        return os.path.splitext(path)[0] + ".lock"
+
+    def rewrite(self, header, lines):
+        tmp = self.path + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(json.dumps(dict(header, pid=os.getpid()), ensure_ascii=False, separators=(",", ":")).encode("utf-8") + b"\n" + b"".join(lines))
+            f.flush(); os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+        self.file = open(self.path, "ab")
+
+    def append(self, at, count, paragraphs):
+        """Records that paragraphs [at, at + count) were replaced by paragraphs. Cheap; the thread does the I/O."""
+        with self.cond:
+            self.seq += 1
+            self.pending.append({"n": self.seq, "at": at, "del": count, "pars": paragraphs})
+            self.cond.notify()
+
+    def write_pending(self):
+        """Called with io held. True when anything was written."""
+        with self.cond: batch, self.pending = self.pending, []
+        if batch:
+            self.file.write(b"".join(json.dumps(r, ensure_ascii=False, separators=(",", ":")).encode("utf-8") + b"\n" for r in batch))
+            self.file.flush()
+        return bool(batch)
+
+    def run(self):
+        while True:
+            with self.cond:
+                self.cond.wait_for(lambda: self.pending or self.closed)
+                self.cond.wait_for(lambda: self.closed, self.SYNC_INTERVAL)
+                if self.closed: return
+            with self.io:
+                if self.file and self.write_pending(): os.fsync(self.file.fileno())
+
+    def compact(self, header, seq):
+        """Restarts the file from a checkpoint holding records up to seq, keeping the later ones.
+        Runs on the writer thread once the save or backup that is the checkpoint is on disk."""
+        with self.io:
+            if self.file is None or seq < self.base: return
+            self.write_pending()
+            self.file.close(); self.file = None
+            try:
+                with open(self.path, "rb") as f: lines = f.readlines()[1:]
+                self.rewrite(dict(header, seq=seq), [line for line in lines if json.loads(line)["n"] > seq])
+                self.base = seq
+            finally:
+                if self.file is None: self.file = open(self.path, "ab")
+
+    def close(self, discard=False):
+        """Writes what is pending and stops; discard removes the file, as on a clean shutdown."""
+        with self.cond:
+            self.closed = True; self.cond.notify_all()
+        self.thread.join()
+        with self.io:
+            if self.file is None: return
+            if self.write_pending(): os.fsync(self.file.fileno())
+            self.file.close(); self.file = None
+            if discard:
+                try: os.remove(self.path)
+                except OSError: pass
+            if self.lock: release_lock(self.lock, self.lock_path(self.path)); self.lock = None
+
+    @staticmethod
+    def replay(path, store):
+        """Rebuilds the document a journal describes; a record torn by the crash ends the replay.
+        Returns (header, paragraphs), paragraphs None when no edit follows the checkpoint, which then is the whole
+        document and already on disk. Raises ValueError when a .docx checkpoint was changed since."""
+        with open(path, "rb") as f: lines = f.read().split(b"\n")
+        header, records = json.loads(lines[0]), []
+        for line in lines[1:]:
+            try: rec = json.loads(line)
+            except ValueError: break
+            if rec["n"] > header["seq"]: records.append(rec)
+        if not records: return header, None
+        cp = header["checkpoint"]
+        if "docx" in cp:
+            st = os.stat(cp["docx"])
+            if (st.st_size, st.st_mtime_ns) != (cp["size"], cp["mtime_ns"]): raise ValueError(f"{cp['docx']} changed since the checkpoint")
+            paragraphs = read_docx_stream(cp["docx"])[0]
+        elif "chunks" in cp: paragraphs = store.load_chunks(cp["chunks"])
+        else: paragraphs = [(align, [tuple(r) for r in runs]) for align, runs in cp["pars"]]
+        if cp.get("pad"): paragraphs = DocumentModel(paragraphs).lines() # as the editor shows a loaded model
+        for rec in records:
+            paragraphs[rec["at"]:rec["at"] + rec["del"]] = [(align, [tuple(r) for r in runs]) for align, runs in rec["pars"]]
+        return header, paragraphs
+
+class UndoHistory:
+    """Undo and redo over paragraph splices, bounded by an estimate of the bytes it holds rather than by steps.
+
+    A step is a list of (at, old paragraphs, new paragraphs) splices undone together: a typing burst, one
+    formatting action, a paste. A burst grows while splices keep coming less than GROUP_SECONDS apart, and a
+    splice inside the paragraphs the last one wrote is folded into it, so typing in a paragraph costs one copy
+    of it. Steps further than RAW_STEPS from the top are packed into zlib-compressed JSON; once the total passes
+    max_bytes the oldest steps go, redo steps last.
+    """
+    RAW_STEPS = 16
+    GROUP_SECONDS = 1.0
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.undo_steps, self.redo_steps = deque(), deque()  # [step or packed bytes, size] entries, newest last
+        self.bytes, self.open, self.last = 0, False, 0.0
+
+    @staticmethod
+    def size_of(step):
+        """Rough bytes of an unpacked step: CPython objects plus text, non-ASCII text counted at four bytes a char."""
+        return 200 + sum(100 + sum(200 + sum(140 + len(r[0]) * (1 if r[0].isascii() else 4) for r in runs) for _, runs in pars)
+                         for _, old, new in step for pars in (old, new))
+
+    @staticmethod
+    def unpack(entry):
+        if not isinstance(entry[0], bytes): return entry[0]
+        conv = lambda pars: [(sys.intern(align), [tuple(r) for r in runs]) for align, runs in pars]
+        return [(at, conv(old), conv(new)) for at, old, new in json.loads(zlib.decompress(entry[0]))]
+
+    def push(self, stack, step):
+        stack.append([step, self.size_of(step)]); self.bytes += stack[-1][1]
+        if len(stack) > self.RAW_STEPS and not isinstance(stack[-1 - self.RAW_STEPS][0], bytes):
+            entry = stack[-1 - self.RAW_STEPS]
+            entry[0] = zlib.compress(json.dumps(entry[0], ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+            self.bytes += len(entry[0]) + 200 - entry[1]; entry[1] = len(entry[0]) + 200
+        while self.bytes > self.max_bytes and (self.undo_steps or self.redo_steps):
+            self.bytes -= (self.undo_steps or self.redo_steps).popleft()[1]
+
+    def record(self, splice):
+        """Adds the splice an edit made: to the open step while a burst goes on, else as a new step. Drops redo steps."""
+        now = time.monotonic()
+        self.bytes -= sum(e[1] for e in self.redo_steps); self.redo_steps.clear()
+        top = self.undo_steps[-1] if self.undo_steps else None
+        if self.open and top and now - self.last < self.GROUP_SECONDS:
+            step, (at, old, new) = top[0], splice
+            a0, old0, new0 = step[-1]
+            k = at - a0
+            if 0 <= k and k + len(old) <= len(new0): step[-1] = (a0, old0, new0[:k] + new + new0[k + len(old):])
+            else: step.append(splice)
+            self.undo_steps.pop(); self.bytes -= top[1]
+            self.push(self.undo_steps, step)
+        else: self.push(self.undo_steps, [splice])
+        self.open, self.last = True, now
+
+    def close(self):
+        """Ends the open step, so the next edit starts a new one."""
+        self.open = False
+
+    def clear(self):
+        self.undo_steps.clear(); self.redo_steps.clear()
+        self.bytes, self.open = 0, False
+
+    def take(self, redo=False):
+        """Pops the next step to undo (or redo); the caller applies it and hands it to put."""
+        stack = self.redo_steps if redo else self.undo_steps
+        self.open = False
+        if not stack: return None
+        entry = stack.pop(); self.bytes -= entry[1]
+        return self.unpack(entry)
+
+    def put(self, step, redo=False):
+        """Files a step just undone onto the redo stack, or one just redone onto the undo stack."""
+        self.push(self.redo_steps if redo else self.undo_steps, step)
+
+class DocumentIndex:
+    """doc_id -> name, path, last-modified time and backup directory, kept in index/index.db.
+
+    SQLite's own file locking lets several running instances register documents without overwriting each other.
+    Lookups are primary-key reads cached in memory; the cache is dropped whenever PRAGMA data_version shows that
+    another connection wrote. The old index/index.json is imported once and renamed to index.json.migrated.
+    """
+    SCHEMA = """CREATE TABLE IF NOT EXISTS docs (
+        doc_id TEXT PRIMARY KEY, name TEXT NOT NULL, path TEXT, modified REAL, backup_dir TEXT)"""
+
+    def __init__(self, index_dir, backups_dir):
+        self.backups_dir = backups_dir
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(os.path.join(index_dir, "index.db"), timeout=10, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        with self.conn: self.conn.execute(self.SCHEMA)
+        self.cache, self.data_version = {}, None
+        self.migrate_json(os.path.join(index_dir, "index.json"))
+
+    def migrate_json(self, json_path):
+        if not os.path.exists(json_path): return
+        try:
+            with open(json_path, "r") as f: legacy = json.load(f)
+        except ValueError:
+            os.replace(json_path, json_path + ".corrupt") # Keep it for inspection instead of starting over silently
+            return
+        except OSError: return
+        with self.lock, self.conn:
+            self.conn.executemany("INSERT OR IGNORE INTO docs (doc_id, name, backup_dir) VALUES (?, ?, ?)",
+                                  [(k, v, os.path.join(self.backups_dir, v)) for k, v in legacy.items() if isinstance(v, str)])
+        try: os.replace(json_path, json_path + ".migrated")
+        except OSError: pass # Another instance migrated it first
+
+    def _check_fresh(self):
+        version = self.conn.execute("PRAGMA data_version").fetchone()[0]
+        if version != self.data_version: self.cache.clear(); self.data_version = version
+
+    def get(self, doc_id):
+        """{"name", "path", "modified", "backup_dir"} for doc_id, or None."""
+        with self.lock:
+            self._check_fresh()
+            if doc_id not in self.cache:
+                row = self.conn.execute("SELECT name, path, modified, backup_dir FROM docs WHERE doc_id = ?", (doc_id,)).fetchone()
+                self.cache[doc_id] = dict(row) if row else None
+            return self.cache[doc_id]
+
+    def register(self, doc_id, name, path=None, backup_dir=None):
+        entry = {"name": name, "path": path, "modified": time.time(), "backup_dir": backup_dir}
+        with self.lock:
+            with self.conn:
+                self.conn.execute("""INSERT INTO docs (doc_id, name, path, modified, backup_dir) VALUES (?, ?, ?, ?, ?)
+                    ON CONFLICT(doc_id) DO UPDATE SET name = excluded.name, path = COALESCE(excluded.path, path),
+                    modified = excluded.modified, backup_dir = COALESCE(excluded.backup_dir, backup_dir)""",
+                    (doc_id, name, path, entry["modified"], backup_dir))
+            self.cache.pop(doc_id, None) # Re-read so COALESCEd columns are right
+        return entry
+
+    def close(self):
+        with self.lock: self.conn.close()
+
+def fts_query(text):
+    """User input to an FTS5 query: "quoted phrases" and words are ANDed; a trailing * makes a prefix search."""
+    terms = []
+    for tok in re.findall(r'"[^"]*"\*?|\S+', text):
+        prefix = tok.endswith("*")
+        core = tok.rstrip("*").strip('"').strip()
+        if core: terms.append('"' + core.replace('"', '""') + '"' + ("*" if prefix else ""))
+    return " ".join(terms)
+
+class SearchIndex:
+    """Full-text index over saved documents and every backup version, in index/search.db (SQLite FTS5).
+
+    Text is indexed per backup chunk (see BackupStore), so the versions that share a chunk share its index rows
+    and a version only adds one small row per chunk. Updates run on a worker thread, fed by saves and backups as
+    they happen plus a catch-up pass at startup over manifests written since the previous pass.
+    """
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+    CREATE TABLE IF NOT EXISTS chunks (id INTEGER PRIMARY KEY, hash TEXT UNIQUE NOT NULL, paragraphs INTEGER NOT NULL);
+    CREATE TABLE IF NOT EXISTS paras (id INTEGER PRIMARY KEY, chunk INTEGER NOT NULL, offset INTEGER NOT NULL);
+    CREATE INDEX IF NOT EXISTS paras_chunk ON paras (chunk);
+    CREATE VIRTUAL TABLE IF NOT EXISTS para_text USING fts5 (text);
+    CREATE TABLE IF NOT EXISTS versions (doc_id TEXT NOT NULL, version TEXT NOT NULL, path TEXT NOT NULL,
+        PRIMARY KEY (doc_id, version)) WITHOUT ROWID;
+    CREATE TABLE IF NOT EXISTS occurrences (doc_id TEXT NOT NULL, version TEXT NOT NULL, start INTEGER NOT NULL,
+        chunk INTEGER NOT NULL, PRIMARY KEY (doc_id, version, start)) WITHOUT ROWID;
+    CREATE INDEX IF NOT EXISTS occurrences_chunk ON occurrences (chunk);
+    """
+
+    def __init__(self, db_path, store):
+        self.db_path, self.store = db_path, store
+        self.conn = sqlite3.connect(db_path, timeout=30, check_same_thread=False) # Used by the worker thread only
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(self.SCHEMA)
+        self.reader = None
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self.run, name="search-indexer", daemon=True)
+
+    def start(self):
+        self.queue.put((self.catch_up,))
+        self.thread.start()
+
+    def report_backup(self, doc_id, manifest_path, removed=()):
+        self.queue.put((self.index_backup, doc_id, manifest_path))
+        for path in removed: self.queue.put((self.remove_path, path))
+
+    def report_saved(self, doc_id, path):
+        self.queue.put((self.index_saved, doc_id, path))
+
+    def report_moved(self, old_dir, new_dir):
+        self.queue.put((self.move_paths, old_dir, new_dir))
+
+    def close(self, timeout=5):
+        self.queue.put(None)
+        if self.thread.is_alive(): self.thread.join(timeout)
+
+    def run(self):
+        while True:
+            job = self.queue.get()
+            if job is None: return
+            try: job[0](*job[1:])
+            except Exception as e: print(f"search index: {job[0].__name__} failed: {e}", file=sys.stderr)
+
+    def index_version(self, doc_id, version, path, chunks):
+        """chunks: [(hash, loader)] in document order; loader() -> paragraphs, only called for unseen chunks."""
+        with self.conn:
+            self.conn.execute("DELETE FROM occurrences WHERE doc_id = ? AND version = ?", (doc_id, version))
+            start = 0
+            for h, load in chunks:
+                row = self.conn.execute("SELECT id, paragraphs FROM chunks WHERE hash = ?", (h,)).fetchone()
+                if row: cid, n = row
+                else:
+                    paragraphs = load()
+                    cid, n = self.conn.execute("INSERT INTO chunks (hash, paragraphs) VALUES (?, ?)", (h, len(paragraphs))).lastrowid, len(paragraphs)
+                    for offset, (_, runs) in enumerate(paragraphs):
+                        text = "".join(r[0] for r in runs)
+                        if not text.strip(): continue
+                        pid = self.conn.execute("INSERT INTO paras (chunk, offset) VALUES (?, ?)", (cid, offset)).lastrowid
+                        self.conn.execute("INSERT INTO para_text (rowid, text) VALUES (?, ?)", (pid, text))
+                self.conn.execute("INSERT INTO occurrences (doc_id, version, start, chunk) VALUES (?, ?, ?, ?)", (doc_id, version, start, cid))
+                start += n
+            self.conn.execute("INSERT OR REPLACE INTO versions (doc_id, version, path) VALUES (?, ?, ?)", (doc_id, version, path))
+
+    def index_backup(self, doc_id, manifest_path):
+        with open(manifest_path, encoding="utf-8") as f: manifest = json.load(f)
+        version = os.path.splitext(os.path.basename(manifest_path))[0]
+        self.index_version(manifest.get("identifier") or doc_id, version, manifest_path,
+                           [(h, lambda h=h: json.loads(self.store.get(h))) for h in manifest["chunks"]])
+
+    def index_saved(self, doc_id, path):
+        model = DocumentModel.from_docx(path)
+        chunks = [(hashlib.sha1(c).hexdigest(), lambda c=c: json.loads(c)) for c in self.store.chunks(model.paragraphs)]
+        self.index_version(model.doc_id or doc_id, "saved", path, chunks)
+
+    def remove_path(self, path):
+        with self.conn:
+            for doc_id, version in self.conn.execute("SELECT doc_id, version FROM versions WHERE path = ?", (path,)).fetchall():
+                self.conn.execute("DELETE FROM occurrences WHERE doc_id = ? AND version = ?", (doc_id, version))
+                self.conn.execute("DELETE FROM versions WHERE doc_id = ? AND version = ?", (doc_id, version))
+
+    def move_paths(self, old_dir, new_dir):
+        old = os.path.join(old_dir, "")
+        with self.conn:
+            self.conn.execute("UPDATE versions SET path = ? || substr(path, ?) WHERE substr(path, 1, ?) = ?",
+                              (os.path.join(new_dir, ""), len(old) + 1, len(old), old))
+
+    def catch_up(self):
+        """Indexes manifests written since the last pass, forgets vanished versions and drops orphaned chunks."""
+        row = self.conn.execute("SELECT value FROM meta WHERE key = 'last_pass'").fetchone()
+        since, started = float(row[0]) if row else 0.0, time.time()
+        root = self.store.root
+        for name in (os.listdir(root) if os.path.isdir(root) else []):
+            if name == ".objects": continue
+            for _, path in self.store.versions(name):
+                try:
+                    if os.path.getmtime(path) > since: self.index_backup("", path)
+                except (OSError, ValueError, KeyError): pass
+        for (path,) in self.conn.execute("SELECT path FROM versions").fetchall():
+            if not os.path.exists(path): self.remove_path(path)
+        with self.conn:
+            orphans = "SELECT id FROM chunks WHERE id NOT IN (SELECT chunk FROM occurrences)"
+            self.conn.execute(f"DELETE FROM para_text WHERE rowid IN (SELECT id FROM paras WHERE chunk IN ({orphans}))")
+            self.conn.execute(f"DELETE FROM paras WHERE chunk IN ({orphans})")
+            self.conn.execute(f"DELETE FROM chunks WHERE id IN ({orphans})")
+            self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('last_pass', ?)", (str(started),))
+
+    def search(self, text, limit=100):
+        """[(doc_id, version, paragraph number, snippet, path)], newest versions first. "saved" sorts before timestamps."""
+        query = fts_query(text)
+        if not query: return []
+        if self.reader is None: self.reader = sqlite3.connect(self.db_path, timeout=10)
+        try:
+            return self.reader.execute("""
+                SELECT o.doc_id, o.version, o.start + p.offset, snippet(para_text, 0, '[', ']', '...', 12), v.path
+                FROM para_text JOIN paras p ON p.id = para_text.rowid
+                JOIN occurrences o ON o.chunk = p.chunk JOIN versions v ON v.doc_id = o.doc_id AND v.version = o.version
+                WHERE para_text MATCH ? ORDER BY o.version DESC, o.doc_id, 3 LIMIT ?""", (query, limit)).fetchall()
+        except sqlite3.OperationalError: return []
+
+# --- Single instance ---
+def hand_off(info_path, paths, timeout=1.0):
+    """Passes paths to an editor that is already running. True when one accepted them."""
+    try:
+        with open(info_path, "r") as f: info = json.load(f)
+        with socket.create_connection(("127.0.0.1", int(info["port"])), timeout=timeout) as conn:
+            conn.sendall(json.dumps({"token": info["token"], "paths": paths}).encode("utf-8") + b"\n")
+            return conn.makefile("rb").readline().strip() == b"ok"
+    except (OSError, ValueError, KeyError, TypeError):
+        return False
+
+class InstanceServer:
+    """Listens on a localhost socket so later launches hand their files to this editor and exit at once.
+
+    The port and a random token go to index/instance.json; hand_off() needs both. Received path lists are
+    queued for the Tk thread, an empty list meaning "just bring the window forward".
+    """
+    def __init__(self, info_path):
+        self.info_path = info_path
+        self.token = secrets.token_hex(16)
+        self.requests = queue.Queue()
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.bind(("127.0.0.1", 0)); self.sock.listen(8)
+        tmp = info_path + ".tmp"
+        with open(tmp, "w") as f: json.dump({"port": self.sock.getsockname()[1], "token": self.token, "pid": os.getpid()}, f)
+        os.replace(tmp, info_path)
+        threading.Thread(target=self.serve, name="instance-server", daemon=True).start()
+
+    def serve(self):
+        while True:
+            try: conn, _ = self.sock.accept()
+            except OSError: return
+            with conn:
+                try:
+                    conn.settimeout(2)
+                    msg = json.loads(conn.makefile("rb").readline(1 << 16))
+                    if msg.get("token") != self.token: continue
+                    self.requests.put([str(p) for p in msg.get("paths", [])])
+                    conn.sendall(b"ok\n")
+                except (OSError, ValueError, AttributeError): pass
+
+    def close(self):
+        try: self.sock.close()
+        except OSError: pass
+        try:
+            with open(self.info_path, "r") as f:
+                if json.load(f).get("token") == self.token: os.remove(self.info_path)
+        except (OSError, ValueError): pass
+
+# --- Tracing ---
+class CountingTk:
+    """Stands in for a Tk interpreter handle and counts the Tcl commands Python sends through it."""
+    def __init__(self, tk, tracer):
+        self._tk, self._tracer = tk, tracer
+
+    def call(self, *args):
+        self._tracer.tk_calls += 1
+        return self._tk.call(*args)
+
+    def __getattr__(self, name):
+        return getattr(self._tk, name)
+
+class Tracer:
+    """Opt-in instrumentation of the editor's hot paths: per operation a count, a latency histogram and the Tk
+    calls made, plus one event per call in a rotating trace file in Chrome's trace event format (open it in
+    chrome://tracing or ui.perfetto.dev).
+
+    Turned on by NONNOWORD_TRACE (a file name, or 1 for trace.json in the data folder) or --trace[=FILE]. When it
+    is off no Tracer exists and nothing is wrapped, so the editor runs exactly the code it runs untraced.
+    """
+    BUCKETS_MS = (0.25, 0.5, 1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024)  # upper bounds; one more bucket past the last
+    MAX_BYTES = 8 << 20  # trace file size before it is rotated to .1, .2, ...
+    KEEP = 3
+
+    def __init__(self, path):
+        self.path = path
+        self.stats = {}  # name -> {"count", "total", "max", "tk_calls", "hist"}
+        self.tk_calls = 0
+        self.tk_thread = threading.get_ident()
+        self.pid = os.getpid()
+        self.lock = threading.Lock()
+        self.file = None
+        self.open_file()
+
+    def open_file(self):
+        """Rotates a full trace file away and (re)opens the current one; the JSON array is left unclosed, as the format allows."""
+        if self.file: self.file.close()
+        if os.path.exists(self.path) and os.path.getsize(self.path) >= self.MAX_BYTES:
+            for i in range(self.KEEP - 1, 0, -1):
+                if os.path.exists(f"{self.path}.{i}"): os.replace(f"{self.path}.{i}", f"{self.path}.{i + 1}")
+            os.replace(self.path, f"{self.path}.1")
+        self.file = open(self.path, "a", encoding="utf-8")
+        if self.file.tell() == 0: self.file.write("[\n")
+
+    def instrument(self, obj, names):
+        for name in names: setattr(obj, name, self.wrap(name, getattr(obj, name)))
+
+    def count_tk(self, widget):
+        """Counts Tk calls of widgets created under widget from now on; they copy its interpreter handle."""
+        widget.tk = CountingTk(widget.tk, self)
+
+    def wrap(self, name, fn):
+        def traced(*args, **kwargs):
+            calls, t0 = self.tk_calls, time.perf_counter()
+            try: return fn(*args, **kwargs)
+            finally: self.record(name, t0, time.perf_counter(), self.tk_calls - calls if threading.get_ident() == self.tk_thread else 0)
+        return traced
+
+    def record(self, name, t0, t1, tk_calls):
+        ms, tid = (t1 - t0) * 1000, threading.get_ident()
+        event = {"name": name, "ph": "X", "ts": round(t0 * 1e6), "dur": round((t1 - t0) * 1e6), "pid": self.pid, "tid": tid, "args": {"tk_calls": tk_calls}}
+        with self.lock:
+            s = self.stats.get(name)
+            if s is None: s = self.stats[name] = {"count": 0, "total": 0.0, "max": 0.0, "tk_calls": 0, "hist": [0] * (len(self.BUCKETS_MS) + 1)}
+            s["count"] += 1; s["total"] += ms; s["max"] = max(s["max"], ms); s["tk_calls"] += tk_calls
+            s["hist"][bisect.bisect_left(self.BUCKETS_MS, ms)] += 1
+            if self.file:
+                self.file.write(json.dumps(event, separators=(",", ":")) + ",\n")
+                if self.file.tell() >= self.MAX_BYTES: self.open_file()
+
+    def percentile(self, name, q):
+        """Upper bound in ms of the histogram bucket holding the q-th quantile (the maximum for the open last bucket)."""
+        s = self.stats[name]
+        rank, seen = q * s["count"], 0
+        for i, n in enumerate(s["hist"]):
+            seen += n
+            if n and seen >= rank: return self.BUCKETS_MS[i] if i < len(self.BUCKETS_MS) else s["max"]
+        return s["max"]
+
+    def summary(self, top=4):
+        """One status-bar line: the operations that took the most time so far."""
+        with self.lock: names = sorted(self.stats, key=lambda n: -self.stats[n]["total"])[:top]
+        parts = []
+        for n in names:
+            s = self.stats[n]
+            parts.append(f"{n} {s['count']}x p50 {self.percentile(n, 0.5):g} p95 {self.percentile(n, 0.95):g} ms {s['tk_calls'] / s['count']:.0f} Tk")
+        return " | ".join(parts) + f" | {self.tk_calls} Tk calls"
+
+    def flush(self):
+        with self.lock:
+            if self.file: self.file.flush()
+
+    def close(self):
+        with self.lock:
+            if self.file: self.file.close(); self.file = None
+
 class WordEmulator:
-    def __init__(self, root):
+    FORMAT_DETECT_DELAY_MS = 40
+    VIRTUAL_THRESHOLD = 5000   # paragraphs; larger documents live in a ParagraphStore and the widget shows a window
+    WINDOW_PARAGRAPHS = 600
+    WINDOW_MARGIN = 150        # reload the window when the view gets this close to one of its edges
+    EDIT_FLUSH_MS = 200        # edits are turned into journal records and undo steps this often
+    UNDO_MAX_MB = 32           # undo history ceiling; NONNOWORD_UNDO_MB or --undo-mb=N overrides it
+    TRACED = ("open_document", "write_docx", "save_file", "save_job", "apply_style_to_range", "get_fingerprint",
+              "perform_backup", "backup_job", "on_key_press", "on_paste", "detect_format_at_cursor", "flush_edits", "load_window",
+              "undo")
+
+    def __init__(self, root, data_dir=None):
         self.root = root
         self.root.title("Python Word Emulator")
         self.root.geometry("1300x850")
 
         # --- State and Paths ---
-        self.base_dir = os.path.dirname(os.path.abspath(__file__))
+        self.base_dir = data_dir or os.path.dirname(os.path.abspath(__file__))
         self.index_dir = os.path.join(self.base_dir, "index")
-        self.index_path = os.path.join(self.index_dir, "index.json")
         self.backups_dir = os.path.join(self.base_dir, "backups")
+        self.journal_dir = os.path.join(self.base_dir, "journal")
+        self.backup_store = BackupStore(self.backups_dir, self.journal_dir)
         
         self.periodic_backup_active = tk.BooleanVar(value=True)
         self.backup_duration_var = tk.StringVar(value="2") 
         self.countdown_seconds = 120 
         self.font_size_var = tk.IntVar(value=12)
+        self.background_save = tk.BooleanVar(value=False)
+        self.writer = BackgroundWriter()
+        self.polling_writer = False
+        self.format_detect_job = None
+        self.shown_buttons = None
+        self.instance = None
+        self.virtual_threshold = self.VIRTUAL_THRESHOLD
+        self.store = None
+        self.window_version = 0
+        self.window_job = None
+        self.journal = None
+        self.baseline, self.baseline_hashes, self.baseline_version = None, [], 0  # the widget's lines as of the last flush_edits
+        self.history = UndoHistory(self.undo_limit())
+        self.undoing = False
         
         self.current_style = {"bold": False, "italic": False, "underline": False, "size": 12}
         self.current_file_path = None
         self.doc_id = str(uuid.uuid4().hex)[:12] 
         self.file_name = self.doc_id 
-        
-        # Fingerprints
-        self.last_saved_fingerprint = None  # Compares against main file
-        self.last_backup_fingerprint = None # Compares against last backup iteration
 
         self.ensure_dirs()
+        trace = os.environ.get("NONNOWORD_TRACE")
+        self.tracer = Tracer(os.path.join(self.base_dir, "trace.json") if trace == "1" else trace) if trace else None
+        if self.tracer: self.tracer.instrument(self, self.TRACED); self.tracer.count_tk(self.root)
+        self.index = DocumentIndex(self.index_dir, self.backups_dir)
+        self.search = SearchIndex(os.path.join(self.index_dir, "search.db"), self.backup_store)
+        self.search.start()
         self.setup_ui()
         self.update_window_title()
         self.start_timer_loop()
+        self.reset_baseline([("left", [])])
+        self.start_journal({"pars": [], "pad": True})
+        self.edit_loop()
 
         self.root.protocol("WM_DELETE_WINDOW", self.on_closing)
 
+    def undo_limit(self):
+        """Undo history ceiling in bytes: NONNOWORD_UNDO_MB if it is a sensible number of megabytes, else UNDO_MAX_MB."""
+        try: mb = float(os.environ.get("NONNOWORD_UNDO_MB", ""))
+        except ValueError: mb = 0
+        return int((mb if 0 < mb < 1 << 20 else self.UNDO_MAX_MB) * (1 << 20))
+
     def ensure_dirs(self):
         os.makedirs(self.index_dir, exist_ok=True)
         os.makedirs(self.backups_dir, exist_ok=True)
-        if not os.path.exists(self.index_path):
-            with open(self.index_path, "w") as f: json.dump({}, f)
+        os.makedirs(self.journal_dir, exist_ok=True)
 
-    def register_in_index(self, doc_id, name):
-        with open(self.index_path, "r") as f: 
-            try: index_data = json.load(f)
-            except: index_data = {}
-        index_data[doc_id] = name
-        with open(self.index_path, "w") as f: json.dump(index_data, f, indent=4)
+    def register_in_index(self, doc_id, name, path=None):
+        """path is a file just read or written as doc_id; without one the indexed path is kept."""
+        self.index.register(doc_id, name, path, os.path.join(self.backups_dir, name))
 
     def get_name_from_index(self, doc_id):
-        with open(self.index_path, "r") as f:
-            try: return json.load(f).get(doc_id)
-            except: return None
+        entry = self.index.get(doc_id)
+        return entry["name"] if entry else None
 
     def setup_ui(self):
         self.toolbar = ttk.Frame(self.root); self.toolbar.pack(side=tk.TOP, fill=tk.X, padx=5, pady=5)
@@ -110,6 +1376,10 @@ class WordEmulator:
         btn_save_as.pack(side=tk.LEFT, padx=2)
         ToolTip(btn_save_as, "Save as a new file identity")
 
+        btn_restore = ttk.Button(file_g, text="\U0001f552 Backups", command=self.export_backup, takefocus=False)
+        btn_restore.pack(side=tk.LEFT, padx=2)
+        ToolTip(btn_restore, "Export a backup version to a .docx file")
+
         # Size Group
         size_g = self.create_tool_group("Size", tk.LEFT)
         self.size_box = ttk.Combobox(size_g, textvariable=self.font_size_var, values=list(range(8, 73, 2)), width=3)
@@ -134,6 +1404,15 @@ class WordEmulator:
         ttk.Button(align_g, text="Center", width=7, command=lambda: self.set_alignment("center"), takefocus=False).pack(side=tk.LEFT)
         ttk.Button(align_g, text="Right", width=6, command=lambda: self.set_alignment("right"), takefocus=False).pack(side=tk.LEFT)
 
+        # Search Group
+        search_g = self.create_tool_group("Search", tk.LEFT)
+        self.search_var = tk.StringVar()
+        search_entry = ttk.Entry(search_g, textvariable=self.search_var, width=18)
+        search_entry.pack(side=tk.LEFT, padx=2)
+        search_entry.bind("<Return>", lambda e: self.show_search_results())
+        ToolTip(search_entry, 'Search all documents and backups: words, "exact phrases", prefix*')
+        ttk.Button(search_g, text="Find", width=5, command=self.show_search_results, takefocus=False).pack(side=tk.LEFT)
+
         # Backup Group
         backup_g = self.create_tool_group("Backup Settings", tk.RIGHT)
         ttk.Checkbutton(backup_g, text="Periodic", variable=self.periodic_backup_active, takefocus=False).pack(side=tk.LEFT, padx=5)
@@ -141,26 +1420,54 @@ class WordEmulator:
         ttk.Label(backup_g, text="min").pack(side=tk.LEFT, padx=2)
         btn_set = ttk.Button(backup_g, text="Set", width=4, command=self.reset_countdown, takefocus=False)
         btn_set.pack(side=tk.LEFT, padx=2)
+        chk_bg = ttk.Checkbutton(backup_g, text="Save in background", variable=self.background_save, takefocus=False)
+        chk_bg.pack(side=tk.LEFT, padx=5)
+        ToolTip(chk_bg, "Write manual saves on the backup thread too")
         self.lbl_countdown = ttk.Label(backup_g, text="Next: 02:00", font=("Consolas", 10, "bold"), foreground="#d9534f")
         self.lbl_countdown.pack(side=tk.LEFT, padx=10)
 
         # Editor
         ed_fr = ttk.Frame(self.root); ed_fr.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
-        sb = ttk.Scrollbar(ed_fr); sb.pack(side=tk.RIGHT, fill=tk.Y)
-        self.text_area = tk.Text(ed_fr, undo=True, font=("Calibri", 12), wrap="word", yscrollcommand=sb.set)
+        self.scrollbar = ttk.Scrollbar(ed_fr); self.scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        self.text_area = tk.Text(ed_fr, undo=False, font=("Calibri", 12), wrap="word", yscrollcommand=self.on_text_scroll)
         self.text_area.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
-        sb.config(command=self.text_area.yview)
+        self.scrollbar.config(command=self.on_scrollbar)
         
-        self.text_area.bind("<<Selection>>", self.detect_format_at_cursor)
+        self.text_area.bind("<<Selection>>", self.schedule_format_detect)
         self.text_area.bind("<Key>", self.on_key_press)
-        self.text_area.bind("<ButtonRelease-1>", self.detect_format_at_cursor)
-        self.text_area.bind("<KeyRelease>", self.detect_format_at_cursor)
+        # event.state bits of the modifiers the Text class ignores: Control plus Alt (0x20000 on Windows, where 0x8
+        # is Num Lock), Mod1 (Alt or Meta on X11, Command on macOS) elsewhere
+        self.shortcut_state = 0x4 | (0x20000 if self.root.tk.call("tk", "windowingsystem") == "win32" else 0x8)
+        self.text_area.bind("<<Paste>>", self.on_paste)
+        self.text_area.bind("<<Undo>>", lambda e: self.undo() or "break")
+        self.text_area.bind("<<Redo>>", lambda e: self.undo(redo=True) or "break")
+        self.text_area.bind("<Button-1>", self.undo_boundary)
+        self.text_area.bind("<ButtonRelease-1>", self.schedule_format_detect)
+        self.text_area.bind("<KeyRelease>", self.schedule_format_detect)
         self.text_area.tag_configure("left", justify="left")
         self.text_area.tag_configure("center", justify="center")
         self.text_area.tag_configure("right", justify="right")
+        self.style_engine = StyleEngine(self.text_area)
+        self.changes = ChangeTracker(self.text_area)
+        self.text_area.bind("<<Modified>>", lambda e: self.update_window_title())
 
         self.setup_bindings()
         self.status = ttk.Label(self.root, text="Ready", relief=tk.SUNKEN, anchor=tk.W); self.status.pack(side=tk.BOTTOM, fill=tk.X)
+        if self.tracer:
+            self.perf_label = ttk.Label(self.status, foreground="#555555")
+            self.perf_label.place(relx=1.0, rely=0.5, anchor=tk.E)
+            self.root.bind("<F12>", lambda e: self.toggle_perf_overlay())
+            self.perf_loop()
+
+    def toggle_perf_overlay(self):
+        if self.perf_label.winfo_ismapped(): self.perf_label.place_forget()
+        else: self.perf_label.place(relx=1.0, rely=0.5, anchor=tk.E)
+
+    def perf_loop(self):
+        """Refreshes the tracing overlay (F12 hides it) and flushes the trace file once a second."""
+        if self.perf_label.winfo_ismapped(): self.perf_label.config(text=self.tracer.summary())
+        self.tracer.flush()
+        self.root.after(1000, self.perf_loop)
 
     def create_tool_group(self, text, side):
         c = ttk.Frame(self.toolbar); c.pack(side=side, padx=10)
@@ -174,14 +1481,14 @@ class WordEmulator:
         self.text_area.bind("<Control-i>", lambda e: self.apply_formatting("italic") or "break")
         self.text_area.bind("<Control-u>", lambda e: self.apply_formatting("underline") or "break")
         self.text_area.bind("<Control-s>", lambda e: self.save_file() or "break")
+        self.text_area.bind("<Control-y>", lambda e: self.undo(redo=True) or "break")
 
     def update_window_title(self):
         name = self.file_name if self.file_name else "New Document"
-        self.root.title(f"Word Emulator - {name}")
+        self.root.title(f"Word Emulator - {name}{' *' if self.text_area.edit_modified() else ''}")
 
     def get_fingerprint(self):
-        raw_dump = self.text_area.dump("1.0", "end-1c", text=True, tag=True)
-        return [item for item in raw_dump if item[0] in ('text', 'tagon', 'tagoff')]
+        return tuple(self.changes.flush())
 
     def start_timer_loop(self):
         if self.periodic_backup_active.get():
@@ -200,55 +1507,251 @@ class WordEmulator:
         except:
             self.backup_duration_var.set("2"); self.countdown_seconds = 120
 
+    def is_blank(self):
+        if self.text_area.search(r"\S", "1.0", "end-1c", regexp=True): return False
+        return not (self.store and self.store.has_text(*self.changes.window[1:]))
+
     def perform_backup(self):
-        current_data = self.get_fingerprint()
-        if not self.text_area.get("1.0", "end-1c").strip(): return
-        
         # SMART BACKUP: Only skip if identical to the LAST BACKUP file
-        if current_data == self.last_backup_fingerprint: return
+        if not self.changes.changed("backup") or self.is_blank(): return
+        if self.changes.same_as("backup"): self.changes.mark("backup"); return
+        n_changed = len(self.changes.changed_paragraphs("backup"))
 
-        target = os.path.join(self.backups_dir, self.file_name)
-        os.makedirs(target, exist_ok=True)
-        ts = datetime.now().strftime("%Y%m%d%H%M")
-        self.write_docx(os.path.join(target, f"{self.file_name}_{ts}.docx"))
-        
-        self.last_backup_fingerprint = current_data
-        self.status.config(text=f"Auto-backup saved: {ts[-4:-2]}:{ts[-2:]}")
+        ts = datetime.now().strftime("%H:%M")
+        self.queue_write(("backup", self.doc_id), f"Auto-backup saved: {ts} ({n_changed} paragraphs changed)",
+                         self.backup_job, self.file_name, self.snapshot(), self.journal_checkpoint())
+        self.changes.mark("backup")
+
+    def backup_job(self, name, snapshot, checkpoint=None):
+        """Runs on the writer thread."""
+        path, removed = self.backup_store.backup(name, snapshot)
+        self.search.report_backup(snapshot[1], path, removed)
+        if checkpoint:
+            journal, seq, header = checkpoint
+            with open(path, encoding="utf-8") as f: chunks = json.load(f)["chunks"]
+            journal.compact(dict(header, checkpoint={"chunks": chunks}), seq)
+
+    def save_job(self, path, snapshot, checkpoint=None):
+        """Runs on the writer thread, or inline for synchronous saves."""
+        model = DocumentModel.from_snapshot(snapshot)
+        model.save(path)
+        self.search.report_saved(snapshot[1], path)
+        if checkpoint:
+            journal, seq, header = checkpoint
+            journal.compact(dict(header, checkpoint={"chunks": self.backup_store.put_chunks(model.paragraphs)}), seq)
+
+    # --- Edit journal ---
+    def journal_header(self):
+        return {"doc_id": self.doc_id, "name": self.file_name, "path": self.current_file_path, "minutes": self.backup_duration_var.get()}
+
+    def docx_checkpoint(self, path, pad=False):
+        st = os.stat(path)
+        return {"docx": path, "size": st.st_size, "mtime_ns": st.st_mtime_ns, "pad": pad}
+
+    def queue_checkpoint(self, paragraphs, pad):
+        """Replaces the .docx checkpoint of a journal just started with chunks, written on the writer thread;
+        chunks replay about ten times faster than the .docx parses. paragraphs is called there."""
+        journal, header, store = self.journal, self.journal_header(), self.backup_store
+        def job(): journal.compact(dict(header, checkpoint={"chunks": store.put_chunks(paragraphs()), "pad": pad}), 0)
+        self.queue_write(("checkpoint", self.doc_id), None, job)
+
+    def start_journal(self, checkpoint):
+        """Journals the current document from now on, starting from checkpoint (see EditJournal)."""
+        self.flush_edits()
+        self.stop_journal()
+        self.journal = EditJournal(os.path.join(self.journal_dir, f"{self.doc_id}.jsonl"), dict(self.journal_header(), checkpoint=checkpoint))
+
+    def stop_journal(self):
+        """Ends journaling of a document that is being closed or replaced on purpose."""
+        if self.journal: self.journal.close(discard=True); self.journal = None
+
+    def edit_loop(self):
+        self.flush_edits()
+        self.root.after(self.EDIT_FLUSH_MS, self.edit_loop)
+
+    def reset_baseline(self, paragraphs):
+        """Takes paragraphs, one per widget line, as what the widget holds now, e.g. after its contents were replaced."""
+        self.baseline = list(paragraphs)
+        self.baseline_hashes, self.baseline_version = list(self.changes.flush_lines()), self.changes.version
+
+    def flush_edits(self):
+        """Turns the lines changed since the last flush, found by comparing line hashes, into one splice of document
+        paragraphs: journaled, and recorded in the undo history unless it is an undo being applied."""
+        if self.baseline is None or self.changes.version == self.baseline_version: return
+        old, hashes = self.baseline_hashes, self.changes.flush_lines()
+        n, i, j = min(len(old), len(hashes)), 0, 0
+        while i < n and old[i] == hashes[i]: i += 1
+        while j < n - i and old[-1 - j] == hashes[-1 - j]: j += 1
+        if i < len(old) - j or i < len(hashes) - j:
+            pars = []
+            if i < len(hashes) - j:
+                dump = self.text_area.dump(f"{i + 1}.0", f"{len(hashes) - j}.end", text=True, tag=True)
+                pars = segments_to_paragraphs(dump_segments(dump, self.text_area.tag_names(f"{i + 1}.0")))
+            at = (self.changes.window[1] if self.changes.window else 0) + i
+            splice = (at, self.baseline[i:len(old) - j], pars)
+            self.baseline[i:len(old) - j] = pars
+            if self.journal: self.journal.append(at, len(old) - i - j, pars)
+            if not self.undoing: self.history.record(splice)
+        self.baseline_hashes, self.baseline_version = list(hashes), self.changes.version
+
+    def journal_checkpoint(self):
+        """(journal, last record, header) for a save or backup job to compact the journal with once it succeeds.
+        Flushes first, so the records up to that point are exactly the edits in the snapshot taken alongside."""
+        if not self.journal: return None
+        self.flush_edits()
+        return self.journal, self.journal.seq, self.journal_header()
+
+    def recover_journals(self):
+        """Replays journals a crashed editor left behind. Each recovered document is stored as a backup version
+        and the most recent one opens in the editor, unsaved. Journals another running editor holds are skipped;
+        those without edits past their checkpoint, or that replay to a blank document, are just removed."""
+        t0, found = time.perf_counter(), []
+        for f in sorted(os.listdir(self.journal_dir)):
+            path = os.path.join(self.journal_dir, f)
+            if not f.endswith(".jsonl") or (self.journal and path == self.journal.path): continue
+            lock = try_lock(EditJournal.lock_path(path))
+            if lock is None: continue
+            try:
+                if not os.path.exists(path): continue # recovered by another editor meanwhile
+                header, paragraphs = EditJournal.replay(path, self.backup_store)
+                if paragraphs is None or not any(text.strip() for _, runs in paragraphs for text, *_ in runs):
+                    os.remove(path); continue # nothing was lost, e.g. the blank document of an idle editor
+                manifest = self.backup_store.save_version(header["name"], paragraphs, header["doc_id"], header["minutes"])
+                with open(manifest, encoding="utf-8") as m: chunks = json.load(m)["chunks"]
+                found.append((os.path.getmtime(path), header, paragraphs, chunks))
+                os.remove(path)
+            except (OSError, ValueError, KeyError, IndexError, TypeError) as e:
+                try: os.replace(path, path + ".failed")
+                except OSError: pass
+                messagebox.showerror("Recovery failed", f"{f}: {e}")
+            finally: release_lock(lock, EditJournal.lock_path(path))
+        if not found: return
+        _, header, paragraphs, chunks = max(found, key=lambda x: x[0])
+        self.doc_id, self.file_name, self.current_file_path = header["doc_id"], header["name"], header["path"]
+        self.backup_duration_var.set(header["minutes"] or "2"); self.reset_countdown()
+        self.show_model(DocumentModel(paragraphs, self.doc_id, header["minutes"]), {"chunks": chunks, "pad": True})
+        self.changes.mark("backup"); self.text_area.edit_modified(True)
+        self.update_window_title()
+        self.status.config(text=f"Recovered {len(found)} document(s) from the edit journal in {(time.perf_counter() - t0) * 1000:.0f} ms")
+
+    def queue_write(self, key, label, fn, *args):
+        self.writer.submit(key, label, fn, *args)
+        if not self.polling_writer: self.polling_writer = True; self.root.after(100, self.poll_writer)
+
+    def poll_writer(self):
+        """Reports finished background writes in the status bar; runs on the Tk thread while writes are queued."""
+        while True:
+            try: key, label, err, secs = self.writer.results.get_nowait()
+            except queue.Empty: break
+            if err is None:
+                if label: self.status.config(text=f"{label} in {secs * 1000:.0f} ms")
+            else:
+                self.status.config(text=f"Background {key[0]} failed: {err}")
+                self.changes.unmark(key[0])
+                if key[0] == "save": self.text_area.edit_modified(True)
+        if self.writer.idle() and self.writer.results.empty(): self.polling_writer = False
+        else: self.root.after(100, self.poll_writer)
+
+    def export_backup(self):
+        folder = os.path.join(self.backups_dir, self.file_name)
+        p = filedialog.askopenfilename(initialdir=folder if os.path.isdir(folder) else self.backups_dir, filetypes=[("Backup version", "*.json")])
+        if not p: return
+        stamp = os.path.splitext(os.path.basename(p))[0]
+        out = filedialog.asksaveasfilename(initialfile=f"{self.file_name}_{stamp}.docx", defaultextension=".docx", filetypes=[("Word", "*.docx")])
+        if not out: return
+        try: self.backup_store.export(p, out)
+        except (OSError, ValueError, KeyError) as e:
+            messagebox.showerror("Export failed", str(e)); return
+        self.status.config(text=f"Exported backup {stamp} to {os.path.basename(out)}")
+
+    def serve_instance(self):
+        """Becomes the editor later launches hand their files to."""
+        self.instance = InstanceServer(os.path.join(self.index_dir, "instance.json"))
+        self.root.after(200, self.poll_instance)
+
+    def poll_instance(self):
+        try:
+            while True:
+                try: paths = self.instance.requests.get_nowait()
+                except queue.Empty: break
+                self.root.deiconify(); self.root.lift(); self.root.focus_force()
+                for p in paths:
+                    if not self.save_before_replacing(): break
+                    self.open_requested(p)
+        finally: self.root.after(200, self.poll_instance)
+
+    def open_requested(self, path):
+        """Opens a file named on a command line, telling the user instead of raising when it can't be read."""
+        try: self.open_document(path)
+        except (OSError, ValueError, KeyError, zipfile.BadZipFile, ET.ParseError) as e:
+            messagebox.showerror("Open failed", f"{path}: {e}")
+
+    def show_search_results(self):
+        query = self.search_var.get()
+        hits = self.search.search(query)
+        win = tk.Toplevel(self.root); win.title(f"Search: {query}"); win.geometry("900x400")
+        cols = ("document", "version", "paragraph", "text")
+        tree = ttk.Treeview(win, columns=cols, show="headings")
+        for c, w in zip(cols, (160, 130, 70, 520)): tree.heading(c, text=c.title()); tree.column(c, width=w, stretch=(c == "text"))
+        sb = ttk.Scrollbar(win, command=tree.yview); tree.config(yscrollcommand=sb.set)
+        sb.pack(side=tk.RIGHT, fill=tk.Y); tree.pack(fill=tk.BOTH, expand=True)
+        for i, (doc_id, version, par, snippet, path) in enumerate(hits):
+            entry = self.index.get(doc_id)
+            when = version if version == "saved" else datetime.strptime(version, "%Y%m%d%H%M").strftime("%Y-%m-%d %H:%M")
+            tree.insert("", tk.END, iid=str(i), values=(entry["name"] if entry else doc_id, when, par + 1, snippet))
+        tree.bind("<Double-1>", lambda e: tree.focus() and self.open_search_hit(hits[int(tree.focus())]))
+        self.status.config(text=f"{len(hits)} matches for {query}")
+
+    def open_search_hit(self, hit):
+        """Saved documents open at the paragraph; backup versions are offered for export."""
+        doc_id, version, par, _, path = hit
+        if version == "saved":
+            if not os.path.exists(path): messagebox.showerror("Search", f"{path} no longer exists"); return
+            if path != self.current_file_path:
+                if not self.save_before_replacing(): return
+                self.open_document(path)
+            self.text_area.mark_set("insert", self.goto_paragraph(par)); self.text_area.see("insert"); self.text_area.focus_set()
+            return
+        entry = self.index.get(doc_id)
+        out = filedialog.asksaveasfilename(initialfile=f"{entry['name'] if entry else doc_id}_{version}.docx", defaultextension=".docx", filetypes=[("Word", "*.docx")])
+        if not out: return
+        try: self.backup_store.export(path, out)
+        except (OSError, ValueError, KeyError) as e:
+            messagebox.showerror("Export failed", str(e)); return
+        self.status.config(text=f"Exported backup {version} to {os.path.basename(out)}")
+
+    def save_before_replacing(self):
+        """Saves unsaved edits before another document replaces this one; False when the user cancelled."""
+        return not (self.changes.changed("save") and not self.is_blank()) or self.save_file()
 
     def sync_structure(self, new_full_path):
-        """Renames backup folder and all internal backup files to match new filename."""
+        """Moves the backup history to match the new filename."""
         new_name_base = os.path.splitext(os.path.basename(new_full_path))[0]
         old_name_base = self.file_name
         
         if old_name_base == new_name_base: return
+        self.writer.wait_idle() # Queued backups still target the old folder
 
-        old_dir = os.path.join(self.backups_dir, old_name_base)
-        new_dir = os.path.join(self.backups_dir, new_name_base)
-
-        if os.path.exists(old_dir):
-            for f in os.listdir(old_dir):
-                # Regex matches [Prefix]_[12 Digits].docx
-                match = re.match(r"(.+)_(\d{12})\.docx$", f)
-                if match:
-                    new_f = f"{new_name_base}_{match.group(2)}.docx"
-                    try: os.rename(os.path.join(old_dir, f), os.path.join(old_dir, new_f))
-                    except: pass
-            try:
-                if not os.path.exists(new_dir): os.rename(old_dir, new_dir)
-            except: pass
+        try:
+            if self.backup_store.rename(old_name_base, new_name_base):
+                self.search.report_moved(os.path.join(self.backups_dir, old_name_base), os.path.join(self.backups_dir, new_name_base))
+        except OSError: pass
 
         self.current_file_path = new_full_path
         self.file_name = new_name_base
         self.update_window_title()
 
     def new_file(self):
-        if self.text_area.get("1.0", "end-1c").strip(): self.save_file()
+        if not self.is_blank(): self.save_file()
         self.doc_id = str(uuid.uuid4().hex)[:12]
         self.file_name = self.doc_id
         self.current_file_path = None
-        self.last_saved_fingerprint = None
-        self.last_backup_fingerprint = None
+        self.store = None
+        self.stop_journal()
         self.text_area.delete("1.0", tk.END)
+        self.changes.reset()
+        self.history.clear(); self.reset_baseline([("left", [])])
+        self.start_journal({"pars": [], "pad": True})
         self.current_style = {"bold": False, "italic": False, "underline": False, "size": 12}
         self.font_size_var.set(12)
         self.update_ui_buttons(); self.update_window_title()
@@ -258,8 +1761,12 @@ class WordEmulator:
     def load_file(self):
         path = filedialog.askopenfilename(filetypes=[("Word", "*.docx")])
         if not path: return
-        doc = Document(path)
-        loaded_id = doc.core_properties.identifier
+        self.open_document(path)
+
+    def open_document(self, path):
+        t0 = time.perf_counter()
+        model = DocumentModel.from_docx(path)
+        loaded_id, t_meta = model.doc_id, model.backup_minutes
         new_disk_name = os.path.splitext(os.path.basename(path))[0]
         
         if loaded_id:
@@ -271,54 +1778,175 @@ class WordEmulator:
             self.file_name = new_disk_name
 
         self.sync_structure(path) # Detects if filename changed on disk
-        self.register_in_index(self.doc_id, self.file_name)
+        self.current_file_path = path # sync_structure only sets it when the name changed
+        self.register_in_index(self.doc_id, self.file_name, path)
 
-        t_meta = doc.core_properties.comments
         self.backup_duration_var.set(t_meta if (t_meta and t_meta.isdigit()) else "2")
         self.reset_countdown()
-        self.text_area.delete("1.0", tk.END)
-        for p in doc.paragraphs:
-            p_st = self.text_area.index("end-1c")
-            for run in p.runs:
-                if not run.text: continue
-                r_st = self.text_area.index("end-1c"); self.text_area.insert(tk.END, run.text); r_en = self.text_area.index("end-1c")
-                sz = int(run.font.size.pt) if run.font.size else 12
-                self.current_style.update({"bold": run.bold, "italic": run.italic, "underline": run.underline, "size": sz})
-                self.apply_style_to_range(r_st, r_en)
-            al = "left"
-            if p.alignment == WD_ALIGN_PARAGRAPH.CENTER: al = "center"
-            elif p.alignment == WD_ALIGN_PARAGRAPH.RIGHT: al = "right"
-            self.text_area.tag_add(al, p_st, "end-1c"); self.text_area.insert(tk.END, "\n")
-        
-        self.last_saved_fingerprint = self.get_fingerprint()
-        self.last_backup_fingerprint = None 
+        self.show_model(model, self.docx_checkpoint(path, pad=True))
+        self.queue_checkpoint(lambda: model.paragraphs, True)
+        self.changes.mark("save")
+        self.status.config(text=f"Loaded {len(model.paragraphs)} paragraphs in {(time.perf_counter() - t0) * 1000:.0f} ms")
         self.text_area.focus_set()
 
+    def show_model(self, model, checkpoint=None):
+        """Replaces the editor contents with the model's paragraphs, or with a window of them for a large document.
+        With a checkpoint the model is journaled from there on. Undo history starts afresh."""
+        self.stop_journal()
+        self.history.clear(); self.baseline = None
+        if self.virtual_threshold and len(model.paragraphs) > self.virtual_threshold:
+            self.changes.reset(); self.store = ParagraphStore.from_model(model)
+            self.load_window(0)
+        else:
+            self.store = None
+            segments = model.segments()
+            self.style_engine.configure_paragraphs(model.paragraphs)
+            self.text_area.delete("1.0", tk.END)
+            self.insert_segments(segments)
+            self.changes.reset(line_hashes(segments))
+            self.reset_baseline(model.lines())
+        if checkpoint: self.start_journal(checkpoint)
+
+    def load_window(self, start, size=None):
+        """Shows size (default WINDOW_PARAGRAPHS) paragraphs of the store from start, after writing edits in the
+        current window back."""
+        store, ta, size = self.store, self.text_area, size or self.WINDOW_PARAGRAPHS
+        if self.window_job: self.root.after_cancel(self.window_job); self.window_job = None
+        self.flush_edits()
+        self.sync_window()
+        start = max(0, min(start, len(store) - size))
+        end = min(len(store), start + size)
+        self.style_engine.configure_paragraphs(store.paragraphs[start:end])
+        modified, self.changes.paused = ta.edit_modified(), True
+        try:
+            ta.delete("1.0", tk.END)
+            self.insert_segments(store.segments(start, end))
+        finally: self.changes.paused = False
+        ta.edit_modified(modified)
+        self.changes.rebase((store, start, end - start), store.hashes[start:end])
+        self.window_version = self.changes.version
+        self.reset_baseline(store.paragraphs[start:end])
+
+    def sync_window(self):
+        """Writes the window back to the store if it was edited since it was loaded."""
+        if not self.changes.window or self.window_version == self.changes.version: return
+        store, start, count = self.changes.window
+        hashes = list(self.changes.flush_lines())
+        paragraphs = segments_to_paragraphs(dump_segments(self.text_area.dump("1.0", "end-1c", text=True, tag=True)))
+        store.splice(start, count, paragraphs, hashes)
+        self.changes.window = (store, start, len(paragraphs))
+        self.window_version = self.changes.version
+
+    def recenter_window(self, top=None):
+        """Reloads the window around document paragraph top (default: the top of the view) and scrolls it there.
+        The cursor keeps its place in the document if that is still loaded, else it moves to the top of the view."""
+        self.window_job = None
+        if not self.store: return
+        ta, start = self.text_area, self.changes.window[1]
+        if top is None: top = start + int(ta.index("@0,0").split(".")[0]) - 1
+        line, col = ta.index("insert").split(".")
+        cursor = start + int(line) - 1
+        self.load_window(top - self.WINDOW_PARAGRAPHS // 3)
+        _, start, count = self.changes.window
+        ta.mark_set("insert", f"{cursor - start + 1}.{col}" if start <= cursor < start + count else f"{top - start + 1}.0")
+        ta.yview(f"{top - start + 1}.0")
+
+    def goto_paragraph(self, par):
+        """Widget index of the start of document paragraph par, loading a window around it if need be."""
+        if self.store:
+            _, start, count = self.changes.window
+            if not start <= par < start + count: self.recenter_window(par)
+            par -= self.changes.window[1]
+        return f"{par + 1}.0"
+
+    def on_text_scroll(self, first, last):
+        """yscrollcommand: for a windowed document, places the scrollbar by document position and moves the
+        window when the view nears one of its edges."""
+        if not self.store: self.scrollbar.set(first, last); return
+        _, start, _ = self.changes.window
+        lines, n = int(self.text_area.index("end-1c").split(".")[0]), len(self.store)
+        top, bottom = float(first) * lines, float(last) * lines
+        self.scrollbar.set((start + top) / n, (start + bottom) / n)
+        if (start and top < self.WINDOW_MARGIN) or (start + lines < n and lines - bottom < self.WINDOW_MARGIN):
+            if not self.window_job: self.window_job = self.root.after_idle(self.recenter_window)
+
+    def on_scrollbar(self, *args):
+        if not self.store or args[0] != "moveto": self.text_area.yview(*args); return
+        top = min(int(float(args[1]) * len(self.store)), len(self.store) - 1)
+        _, start, count = self.changes.window
+        if start <= top < start + count: self.text_area.yview(f"{top - start + 1}.0")
+        else: self.recenter_window(max(top, 0))
+
+    # --- Undo ---
+    def undo_boundary(self, event=None):
+        """Ends the undo step being typed, e.g. on a click or around a formatting action."""
+        self.flush_edits(); self.history.close()
+
+    def undo(self, redo=False):
+        """Undoes (or redoes) one step of the history; edits not flushed yet become a step of their own first."""
+        self.flush_edits()
+        step = self.history.take(redo)
+        if not step: self.status.config(text="Nothing to redo" if redo else "Nothing to undo"); return
+        self.undoing = True
+        try:
+            for at, old, new in (step if redo else reversed(step)):
+                self.replace_paragraphs(at, len(old if redo else new), new if redo else old)
+            self.flush_edits()
+        finally: self.undoing = False
+        self.history.put(step, redo=not redo)
+        self.text_area.see("insert")
+
+    def replace_paragraphs(self, at, count, paragraphs):
+        """Replaces document paragraphs [at, at + count) through the widget, loading a window over them if need be,
+        and leaves the cursor after them. The change is tracked like any edit."""
+        ta = self.text_area
+        if self.store:
+            _, start, loaded = self.changes.window
+            if not start <= at <= at + count <= start + loaded:
+                self.load_window(at - self.WINDOW_MARGIN, max(self.WINDOW_PARAGRAPHS, count + 2 * self.WINDOW_MARGIN))
+            at -= self.changes.window[1]
+        self.style_engine.configure_paragraphs(paragraphs)
+        segments, line, lines = DocumentModel(paragraphs).segments()[:-1], at + 1, int(ta.index("end-1c").split(".")[0])
+        if count and paragraphs: ta.delete(f"{line}.0", f"{line + count - 1}.end"); index = f"{line}.0"
+        elif count:
+            if line + count <= lines: ta.delete(f"{line}.0", f"{line + count}.0")
+            elif line > 1: ta.delete(f"{line - 1}.end", f"{line + count - 1}.end")
+            else: ta.delete("1.0", "end-1c")
+            index = None
+        elif line <= lines: segments.append(("\n", ())); index = f"{line}.0"
+        else: segments.insert(0, ("\n", ())); index = "end-1c"
+        if segments:
+            ta.mark_set("splice", index)
+            self.insert_segments(segments, "splice")
+            ta.mark_unset("splice")
+        ta.mark_set("insert", f"{line + len(paragraphs) - 1}.end" if paragraphs else f"{line}.0")
+
+    def insert_segments(self, segments, index=tk.END, chunk=4096):
+        """Inserts segments with Tk's multi-argument text/tags form, a few thousand per call."""
+        for i in range(0, len(segments), chunk):
+            self.text_area.insert(index, *[x for seg in segments[i:i + chunk] for x in seg])
+
+    def snapshot(self):
+        """Immutable copy of the document for the writer thread; the only part of a save that needs Tk.
+        Of a windowed document only the window is dumped; the rest is copied from the store."""
+        dump = self.text_area.dump("1.0", "end-1c", text=True, tag=True)
+        if self.store:
+            store, start, count = self.changes.window
+            dump = (store.paragraphs[:start], dump, store.paragraphs[start + count:])
+        return dump, self.doc_id, self.backup_duration_var.get()
+
     def write_docx(self, path):
-        doc = Document(); doc.core_properties.identifier = self.doc_id 
-        doc.core_properties.comments = self.backup_duration_var.get() 
-        content = self.text_area.dump("1.0", "end-1c", text=True, tag=True)
-        active_tags, p = set(), doc.add_paragraph()
-        a_map = {"center": WD_ALIGN_PARAGRAPH.CENTER, "right": WD_ALIGN_PARAGRAPH.RIGHT, "left": WD_ALIGN_PARAGRAPH.LEFT}
-        for type, val, idx in content:
-            if type == "tagon": active_tags.add(val)
-            elif type == "tagoff": active_tags.discard(val)
-            elif type == "text":
-                if val == "\n": p = doc.add_paragraph(); continue
-                run = p.add_run(val)
-                run.bold, run.italic, run.underline = "bold" in active_tags, "italic" in active_tags, "underline" in active_tags
-                sz = 12
-                for t in active_tags:
-                    if t.startswith("sz_"): sz = int(t.split("_")[1])
-                run.font.size = Pt(sz)
-                for a, wd_a in a_map.items():
-                    if a in active_tags: p.alignment = wd_a
-        doc.save(path)
-
-    def save_file(self):
+        self.save_job(path, self.snapshot())
+
+    def save_file(self, background=None):
         if self.current_file_path:
-            self.write_docx(self.current_file_path); self.register_in_index(self.doc_id, self.file_name)
-            self.last_saved_fingerprint = self.get_fingerprint(); self.status.config(text="Updated")
+            if background is None: background = self.background_save.get()
+            if background: self.queue_write(("save", self.current_file_path), "Updated", self.save_job, self.current_file_path, self.snapshot(), self.journal_checkpoint())
+            else:
+                self.writer.cancel(("save", self.current_file_path))
+                self.save_job(self.current_file_path, self.snapshot(), self.journal_checkpoint()); self.status.config(text="Updated")
+            self.register_in_index(self.doc_id, self.file_name, self.current_file_path)
+            self.changes.mark("save")
             return True
         return self.save_as_file()
 
@@ -326,18 +1954,32 @@ class WordEmulator:
         p = filedialog.asksaveasfilename(initialfile=f"{self.file_name}.docx", defaultextension=".docx", filetypes=[("Word", "*.docx")])
         if not p: return False
         self.sync_structure(p) 
+        self.current_file_path = p
         self.doc_id = str(uuid.uuid4().hex)[:12] 
-        self.write_docx(self.current_file_path); self.register_in_index(self.doc_id, self.file_name)
-        self.last_saved_fingerprint = self.get_fingerprint(); self.last_backup_fingerprint = None
+        snapshot = self.snapshot()
+        self.writer.cancel(("save", p))
+        self.save_job(self.current_file_path, snapshot); self.register_in_index(self.doc_id, self.file_name, p)
+        self.changes.mark("save"); self.changes.unmark("backup")
+        self.start_journal(self.docx_checkpoint(self.current_file_path))
+        self.queue_checkpoint(lambda: DocumentModel.from_snapshot(snapshot).paragraphs, False)
         return True
 
     # --- Formatting Helpers ---
     def update_ui_buttons(self):
+        state = (bool(self.current_style["bold"]), bool(self.current_style["italic"]), bool(self.current_style["underline"]))
+        if state == self.shown_buttons: return
+        self.shown_buttons = state
         self.btn_bold.config(bg="#add8e6" if self.current_style["bold"] else "SystemButtonFace", relief="sunken" if self.current_style["bold"] else "raised")
         self.btn_italic.config(bg="#add8e6" if self.current_style["italic"] else "SystemButtonFace", relief="sunken" if self.current_style["italic"] else "raised")
         self.btn_underline.config(bg="#add8e6" if self.current_style["underline"] else "SystemButtonFace", relief="sunken" if self.current_style["underline"] else "raised")
 
+    def schedule_format_detect(self, event=None):
+        """Debounces toolbar updates: a burst of key releases, clicks and selection changes costs one detection."""
+        if self.format_detect_job: self.root.after_cancel(self.format_detect_job)
+        self.format_detect_job = self.root.after(self.FORMAT_DETECT_DELAY_MS, self.detect_format_at_cursor)
+
     def detect_format_at_cursor(self, event=None):
+        self.format_detect_job = None
         try: idx = self.text_area.index("sel.first")
         except tk.TclError:
             idx = self.text_area.index("insert - 1c")
@@ -346,13 +1988,17 @@ class WordEmulator:
         self.current_style.update({"bold": "bold" in tags, "italic": "italic" in tags, "underline": "underline" in tags})
         for t in tags:
             if t.startswith("sz_"):
-                self.current_style["size"] = int(t.split("_")[1]); self.font_size_var.set(self.current_style["size"]); break
+                self.current_style["size"] = int(t.split("_")[1])
+                if self.font_size_var.get() != self.current_style["size"]: self.font_size_var.set(self.current_style["size"])
+                break
         self.update_ui_buttons()
 
     def apply_formatting(self, style_type):
         try:
             st, en = self.text_area.index("sel.first"), self.text_area.index("sel.last")
+            self.undo_boundary()
             self.apply_style_to_range(st, en, toggle_type=style_type)
+            self.undo_boundary()
         except tk.TclError:
             if style_type == "bold": self.current_style["bold"] = not self.current_style["bold"]
             elif style_type == "italic": self.current_style["italic"] = not self.current_style["italic"]
@@ -361,49 +2007,137 @@ class WordEmulator:
         self.detect_format_at_cursor(); self.text_area.focus_set()
 
     def apply_style_to_range(self, start, end, toggle_type=None):
-        curr = self.text_area.index(start)
-        while self.text_area.compare(curr, "<", end):
-            tags = self.text_area.tag_names(curr)
-            is_b = not ("bold" in tags) if toggle_type == "bold" else (self.current_style["bold"] if not toggle_type else "bold" in tags)
-            is_i = not ("italic" in tags) if toggle_type == "italic" else (self.current_style["italic"] if not toggle_type else "italic" in tags)
-            is_u = not ("underline" in tags) if toggle_type == "underline" else (self.current_style["underline"] if not toggle_type else "underline" in tags)
-            sz = self.font_size_var.get() if toggle_type == "size" else (self.current_style["size"] if not toggle_type else self.get_size_at(curr))
-            
-            for t in tags:
-                if t in ["bold", "italic", "underline"] or t.startswith("sz_") or t.startswith("comp_"):
-                    self.text_area.tag_remove(t, curr)
-            if is_b: self.text_area.tag_add("bold", curr)
-            if is_i: self.text_area.tag_add("italic", curr)
-            if is_u: self.text_area.tag_add("underline", curr)
-            self.text_area.tag_add(f"sz_{sz}", curr)
-            comp = f"comp_{sz}_{'b' if is_b else ''}{'i' if is_i else ''}"
-            st_l = ["bold" if is_b else None, "italic" if is_i else None]
-            self.text_area.tag_configure(comp, font=("Calibri", sz, " ".join(filter(None, st_l))))
-            self.text_area.tag_configure("underline", underline=True)
-            self.text_area.tag_add(comp, curr); curr = self.text_area.index(f"{curr} + 1c")
+        """Restyles [start, end). Without toggle_type the current style is applied; otherwise only that attribute changes."""
+        cs, new_sz = self.current_style, self.font_size_var.get() if toggle_type == "size" else None
+        def style_for(tags):
+            if not toggle_type: return cs["bold"], cs["italic"], cs["underline"], cs["size"]
+            b, i, u = "bold" in tags, "italic" in tags, "underline" in tags
+            if toggle_type == "bold": b = not b
+            elif toggle_type == "italic": i = not i
+            elif toggle_type == "underline": u = not u
+            return b, i, u, new_sz if toggle_type == "size" else size_of_tags(tags)
+        self.style_engine.apply(start, end, style_for)
 
     def get_size_at(self, index):
-        for t in self.text_area.tag_names(index):
-            if t.startswith("sz_"): return int(t.split("_")[1])
-        return 12
+        return size_of_tags(self.text_area.tag_names(index))
+
+    def typing_tags(self):
+        """Tags for text typed at the cursor: the current style plus the paragraph's alignment."""
+        cs = self.current_style
+        tags = self.style_engine.tags_for(cs["bold"], cs["italic"], cs["underline"], cs["size"])
+        for t in self.text_area.tag_names("insert linestart"):
+            if t in ALIGN_TAGS: return tags + (t,)
+        return tags
+
+    def insert_typed(self, text):
+        """Replaces the selection (if the cursor is in it) with text carrying the typing tags, in one insert."""
+        ta = self.text_area
+        try:
+            if ta.compare("sel.first", "<=", "insert") and ta.compare("sel.last", ">=", "insert"): ta.delete("sel.first", "sel.last")
+        except tk.TclError: pass
+        ta.insert("insert", text, self.typing_tags()); ta.see("insert")
 
     def on_key_press(self, event):
+        """Types printable characters; with Control, Alt, Meta or Command held the Text class bindings decide."""
+        if event.state & self.shortcut_state: return
         if len(event.char) > 0 and event.char.isprintable():
-            self.root.after(1, lambda: self.apply_style_to_range("insert - 1c", "insert"))
+            self.insert_typed(event.char)
+            return "break"
+
+    def on_paste(self, event=None):
+        try: text = self.root.clipboard_get()
+        except tk.TclError: return "break"
+        self.undo_boundary()
+        self.insert_typed(text)
+        self.undo_boundary()
+        return "break"
 
     def set_alignment(self, align):
         try:
             try: st, en = self.text_area.index("sel.first"), self.text_area.index("sel.last")
             except: st, en = self.text_area.index("insert linestart"), self.text_area.index("insert lineend")
+            self.undo_boundary()
             for a in ["left", "center", "right"]: self.text_area.tag_remove(a, st, en)
             self.text_area.tag_add(align, st, en)
+            self.undo_boundary()
         except: pass
         self.text_area.focus_set()
 
     def on_closing(self):
-        if self.text_area.get("1.0", "end-1c").strip():
-            if self.save_file(): self.root.destroy()
-        else: self.root.destroy()
+        if not self.is_blank():
+            if not self.save_file(background=False): return
+        self.stop_journal()
+        if self.instance: self.instance.close()
+        self.writer.close(); self.search.close(); self.index.close()
+        if self.tracer: self.tracer.close()
+        self.root.destroy()
+
+# --- Batch command line ---
+def _batch_one(command, src, dst, fmt):
+    """Runs in a pool worker: one file in, one file out. Returns (src, paragraphs, error)."""
+    try:
+        if src.lower().endswith(".txt"):
+            with open(src, encoding="utf-8") as f:
+                model = DocumentModel([("left", [(line, False, False, False, 12)] if line else []) for line in f.read().split("\n")])
+        else: model = DocumentModel.from_docx(src)
+        if command == "normalize": model.normalize()
+        os.makedirs(os.path.dirname(dst) or ".", exist_ok=True)
+        if fmt == "txt":
+            with open(dst, "w", encoding="utf-8") as f: f.write(model.text())
+        elif fmt == "json":
+            with open(dst, "w", encoding="utf-8") as f:
+                json.dump({"doc_id": model.doc_id, "backup_minutes": model.backup_minutes, "paragraphs": model.paragraphs}, f, ensure_ascii=False)
+        else: model.save(dst)
+        return src, len(model.paragraphs), None
+    except Exception as e:
+        return src, 0, f"{type(e).__name__}: {e}"
+
+def _batch_sources(paths, exts):
+    """(root, file) pairs for every matching file under the given files and folders."""
+    for p in paths:
+        if os.path.isdir(p):
+            for dirpath, _, files in os.walk(p):
+                for f in sorted(files):
+                    if f.lower().endswith(exts) and not f.startswith("~$"): yield p, os.path.join(dirpath, f)
+        else: yield os.path.dirname(p), p
+
+def run_batch(argv):
+    import argparse
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+    parser = argparse.ArgumentParser(prog="script.py", description="Batch-process .docx files without opening the editor.")
+    parser.add_argument("command", choices=["resave", "normalize", "convert"],
+                        help="resave: rewrite through the streaming writer; normalize: also clean runs/paragraphs; convert: change format")
+    parser.add_argument("paths", nargs="+", help=".docx files or folders (searched recursively)")
+    parser.add_argument("-o", "--out", help="output folder, mirroring the input tree (default: rewrite in place)")
+    parser.add_argument("--to", choices=["docx", "txt", "json"], default="docx", help="output format for convert (default: docx)")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count(), help="worker processes (default: CPU count)")
+    args = parser.parse_args(argv)
+    fmt = args.to if args.command == "convert" else "docx"
+    exts = (".docx", ".txt") if args.command == "convert" else (".docx",)
+    jobs = []
+    for root_dir, src in _batch_sources(args.paths, exts):
+        dst = src if not args.out else os.path.join(args.out, os.path.relpath(src, root_dir))
+        jobs.append((args.command, src, os.path.splitext(dst)[0] + "." + fmt, fmt))
+    t0, failed = time.perf_counter(), 0
+    with ProcessPoolExecutor(max_workers=max(1, args.jobs)) as pool:
+        for fut in as_completed([pool.submit(_batch_one, *job) for job in jobs]):
+            src, n, err = fut.result()
+            if err: failed += 1; print(f"FAILED {src}: {err}", file=sys.stderr)
+            else: print(f"{src}: {n} paragraphs")
+    print(f"{len(jobs) - failed}/{len(jobs)} files in {time.perf_counter() - t0:.1f} s with {args.jobs} workers")
+    return 1 if failed else 0
 
 if __name__ == "__main__":
-    root = tk.Tk(); app = WordEmulator(root); root.mainloop()
\ No newline at end of file
+    if len(sys.argv) > 1 and sys.argv[1] in ("resave", "normalize", "convert"): sys.exit(run_batch(sys.argv[1:]))
+    # script.py [--new-instance] [--trace[=FILE]] [--undo-mb=N] [FILE.docx ...]: unless told otherwise, a running editor opens the files instead
+    flags = [a for a in sys.argv[1:] if a.startswith("--")]
+    paths = [os.path.abspath(a) for a in sys.argv[1:] if not a.startswith("--")]
+    single = "--new-instance" not in flags
+    for f in flags:
+        if f == "--trace" or f.startswith("--trace="): os.environ["NONNOWORD_TRACE"] = f.partition("=")[2] or "1"
+        elif f.startswith("--undo-mb="): os.environ["NONNOWORD_UNDO_MB"] = f.partition("=")[2]
+    if single and hand_off(os.path.join(os.path.dirname(os.path.abspath(__file__)), "index", "instance.json"), paths): sys.exit(0)
+    root = tk.Tk(); app = WordEmulator(root)
+    if single: app.serve_instance(); app.recover_journals()
+    for p in paths: root.after_idle(app.open_requested, p)
+    root.mainloop()
\ No newline at end of file
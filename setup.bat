@@ -25,7 +25,7 @@ if not exist "%ABS_SCRIPT%" (
 )
 
 :: 2. Create Virtual Environment
-echo [1/3] Creating Virtual Environment in: "%ABS_VENV%"...
+echo [1/2] Creating Virtual Environment in: "%ABS_VENV%"...
 python -m venv "%ABS_VENV%"
 if %ERRORLEVEL% neq 0 (
     echo [ERROR] Failed to create virtual environment. 
@@ -34,17 +34,8 @@ if %ERRORLEVEL% neq 0 (
     exit /b
 )
 
-:: 3. Install Dependencies
-echo [2/3] Installing required libraries (python-docx)...
-"%ABS_VENV%\Scripts\pip" install python-docx --quiet
-if %ERRORLEVEL% neq 0 (
-    echo [ERROR] Failed to install dependencies. Check your internet connection.
-    pause
-    exit /b
-)
-
-:: 4. Create the Launcher .bat
-echo [3/3] Creating Launcher: %LAUNCHER_NAME%...
+:: 3. Create the Launcher .bat
+echo [2/2] Creating Launcher: %LAUNCHER_NAME%...
 
 echo @echo off > "%LAUNCHER_NAME%"
 echo :: This file triggers the Python Word Emulator using its specific venv >> "%LAUNCHER_NAME%"